@@ -0,0 +1,149 @@
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from pathlib import Path
+
+from errors import ScraperError
+from pipeline import DEFAULT_OPTIONS, Pipeline
+
+# Batch mode: Processes many mod profiles (e.g. modpacks) against the same Factorio install.
+#
+# The profiles file is a JSON list, relative paths are relative to the profiles file:
+#     [
+#       {"name": "modpack-a", "mods": "modpack-a/mods", "log": "modpack-a/factorio-current.log",
+#        "scriptOutput": "modpack-a/script-output"},
+#       ...
+#     ]
+# Only 'mods' is required: 'name' defaults to the folder that contains the mods folder, 'log' and
+# 'scriptOutput' to the ones of the game (see pipeline.loadData).
+# Every profile is written to <outputDir>/<name>/, its messages go to <outputDir>/<name>/postprocessing.log.
+#
+# The work that is the same for all profiles is only done once:
+#   - All profiles share one cache folder (see factorioPaths.defaultCacheDir). The icon cache is
+#     content-addressed, so every icon is rendered and stored once, the icons folders of the
+#     profiles only get hardlinks into it. The locale cache holds the parsed core and base locale.
+#   - The first profile is processed alone, which fills the caches with core, base and the vanilla
+#     icons. The others are processed in parallel (one profile per process, --jobs processes)
+#     afterwards. The workers are forked from the warm process (where supported), so they start
+#     with the parsed locale files and decoded icon layers in memory, see pipeline.Pipeline.
+
+# profilesFile: Path of the JSON list, returns the profiles with absolute paths
+def loadProfiles(profilesFile):
+    try:
+        with open(profilesFile, 'r') as f:
+            profiles = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ScraperError(f"Unable to read the profiles: {e}")
+    if not isinstance(profiles, list) or not profiles:
+        raise ScraperError(f"The profiles file has to contain a non-empty list: {profilesFile}")
+
+    baseDir = Path(profilesFile).resolve().parent
+    result = []
+    names = set()
+    for (idx, profile) in enumerate(profiles):
+        if not isinstance(profile, dict) or not profile.get('mods'):
+            raise ScraperError(f"Profile {idx} has no 'mods' folder")
+
+        mods = baseDir / profile['mods']
+        name = profile.get('name') or mods.resolve().parent.name
+        if name in names:
+            raise ScraperError(f"There are several profiles named '{name}'")
+        names.add(name)
+
+        result.append({
+            'name': name,
+            'mods': mods,
+            'log': baseDir / profile['log'] if profile.get('log') else None,
+            'scriptOutput': baseDir / profile['scriptOutput'] if profile.get('scriptOutput') else None,
+        })
+    return result
+
+
+def runBatch(dirs, options, profiles):
+    # Parallel over the profiles, every profile renders its icons in its own process.
+    jobs = options['jobs'] if options['jobs'] else (os.cpu_count() or 1)
+    profileOptions = {k: v for (k, v) in options.items() if k in DEFAULT_OPTIONS}
+    profileOptions['jobs'] = 1
+    initargs = (dirs['game'], profileOptions, dirs['cache'])
+
+    jobList = []
+    for profile in profiles:
+        outputDir = dirs['output'] / profile['name']
+        outputDir.mkdir(exist_ok=True)
+        sqliteFile = outputDir / 'output.sqlite' if dirs['sqlite'] else None
+        jobList.append((profile, outputDir, sqliteFile))
+
+    print(f"INFO  Processing {len(profiles)} profile(s), the first one alone to fill the caches")
+    start = time.time()
+    results = []
+
+    initWorker(*initargs)
+    results.append(reportProfile(runProfile(jobList[0]), len(results) + 1, len(jobList)))
+
+    if len(jobList) > 1:
+        jobs = min(jobs, len(jobList) - 1)
+        if jobs == 1:
+            profileResults = map(runProfile, jobList[1:])
+            pool = None
+        else:
+            pool = multiprocessing.Pool(jobs, initializer=initWorker, initargs=initargs)
+            profileResults = pool.imap_unordered(runProfile, jobList[1:])
+        try:
+            for result in profileResults:
+                results.append(reportProfile(result, len(results) + 1, len(jobList)))
+        finally:
+            if pool:
+                pool.terminate()
+
+    failed = [result['name'] for result in results if result['error']]
+    print(f"\nDone. Processed {len(results) - len(failed)} of {len(results)} profile(s) in {time.time() - start:.1f}s, writing to:  {dirs['output']}")
+    if failed:
+        raise ScraperError(f"{len(failed)} profile(s) failed: {', '.join(failed)}")
+
+
+def reportProfile(result, counter, total):
+    if result['error']:
+        print(f"WARN  [{counter}/{total}] {result['name']} failed after {result['time']:.1f}s: {result['error']}")
+    elif result['stats'] is None:
+        print(f"INFO  [{counter}/{total}] {result['name']} done in {result['time']:.1f}s")
+    else:
+        stats = result['stats']
+        print(f"INFO  [{counter}/{total}] {result['name']} done in {result['time']:.1f}s "
+              f"({stats['rendered'] - stats['cacheHits']} icon(s) rendered, {stats['cacheHits']} from the cache)")
+    return result
+
+
+## Worker side
+# With fork the workers inherit the pipeline of the first profile, including its warm caches.
+workerPipeline = None
+
+def initWorker(gameDir, options, cacheDir):
+    global workerPipeline
+    if workerPipeline is None:
+        workerPipeline = Pipeline(gameDir, options, cacheDir=cacheDir, quiet=True)
+
+
+# Returns {'name', 'time', 'stats', 'error'}, failures are reported instead of raised so the
+# other profiles are processed anyway.
+def runProfile(job):
+    (profile, outputDir, sqliteFile) = job
+    result = {'name': profile['name'], 'time': 0, 'stats': None, 'error': None}
+
+    start = time.time()
+    try:
+        workerPipeline.run(profile['mods'], outputDir, logFile=profile['log'],
+                           scriptOutput=profile['scriptOutput'], sqliteFile=sqliteFile)
+        result['stats'] = workerPipeline.stats
+    except ScraperError as e:
+        result['error'] = str(e)
+        workerPipeline.log += f"\nERROR  {e}\n"
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+        workerPipeline.log += traceback.format_exc()
+    result['time'] = time.time() - start
+
+    with open(outputDir / 'postprocessing.log', 'w') as f:
+        f.write(workerPipeline.log)
+    return result
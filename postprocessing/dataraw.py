@@ -0,0 +1,161 @@
+import json
+import mmap
+from collections.abc import Mapping
+
+# Extracts data.raw from factorio-current.log (see data-final-fixes.lua).
+#
+# The log is memory-mapped, so the (potentially huge) JSON between the markers is never
+# assembled line by line: It is decoded straight from the mapped file, either all at once
+# (loadDataRaw) or one type at a time on access (LazyDataRaw).
+#
+# Both use the C decoder of the json module. Finding where a type ends means decoding it (see
+# scanTopLevel), so the modes only differ in memory: loadDataRaw is the fastest, LazyDataRaw only
+# keeps the accessed types decoded.
+
+MARKER_START = b"---- data export start ----"
+MARKER_END   = b"---- data export end   ----"
+
+
+# Returns (mappedLog, start, end) of the JSON data, or None if the log does not contain it.
+# The data is everything between the line with MARKER_START and the line with MARKER_END.
+def mapDataRaw(logFile):
+    with open(logFile, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return None
+
+    markerStart = mm.find(MARKER_START)
+    if markerStart < 0:
+        mm.close()
+        return None
+    start = mm.find(b'\n', markerStart) + 1
+
+    markerEnd = mm.find(MARKER_END, start)
+    if start == 0 or markerEnd < 0:
+        mm.close()
+        return None
+    end = mm.rfind(b'\n', start, markerEnd) + 1
+
+    if end <= start:
+        mm.close()
+        return None
+    return (mm, start, end)
+
+
+# Decodes all of data.raw in one go, returns None if the log does not contain it.
+def loadDataRaw(logFile):
+    mapped = mapDataRaw(logFile)
+    if mapped is None:
+        return None
+
+    (mm, start, end) = mapped
+    try:
+        return json.loads(mm[start:end])
+    finally:
+        mm.close()
+
+
+# Returns the JSON data of the log as str (json.JSONDecoder.raw_decode needs one), or None.
+def mapDataRawText(logFile):
+    mapped = mapDataRaw(logFile)
+    if mapped is None:
+        return None
+
+    (mm, start, end) = mapped
+    try:
+        return mm[start:end].decode('utf-8')
+    finally:
+        mm.close()
+
+
+# Yields (key, valueStart, valueEnd, value) for every value of the JSON object in text.
+# The values are decoded one after another with raw_decode, which returns where they end.
+# Raises ValueError if text is not a JSON object.
+def scanTopLevel(text):
+    decoder = json.JSONDecoder()
+    pos = skipWhitespace(text, 0)
+    if not text.startswith('{', pos):
+        raise ValueError("data.raw is not a JSON object")
+
+    pos = skipWhitespace(text, pos + 1)
+    if text.startswith('}', pos):
+        return
+    while True:
+        (key, pos) = decoder.raw_decode(text, pos)
+        pos = skipWhitespace(text, pos)
+        if not text.startswith(':', pos):
+            raise ValueError(f"Expected ':' at {pos}")
+        valueStart = skipWhitespace(text, pos + 1)
+        (value, valueEnd) = decoder.raw_decode(text, valueStart)
+        yield (key, valueStart, valueEnd, value)
+
+        pos = skipWhitespace(text, valueEnd)
+        if text.startswith('}', pos):
+            return
+        if not text.startswith(',', pos):
+            raise ValueError(f"Expected ',' or '}}' at {pos}")
+        pos = skipWhitespace(text, pos + 1)
+
+
+def skipWhitespace(text, pos):
+    return json.decoder.WHITESPACE.match(text, pos).end()
+
+
+# Read-only mapping of data.raw which only keeps the accessed types decoded.
+#
+# The data is decoded once to find where every type is (see scanTopLevel), but only the positions
+# are kept: raw['recipe'] decodes all recipes again and keeps them until release(), so each
+# processing stage only keeps its own types in memory. This needs the least memory, but takes
+# longer than decoding everything at once (loadDataRaw).
+class LazyDataRaw(Mapping):
+    def __init__(self, text):
+        self.text = text
+        self.index = {}     # type -> (start, end)
+        self.loaded = {}    # type -> prototypes
+
+        for (key, valueStart, valueEnd, _) in scanTopLevel(text):
+            self.index[key] = (valueStart, valueEnd)
+
+    def __getitem__(self, key):
+        if not key in self.loaded:
+            (start, end) = self.index[key]
+            self.loaded[key] = json.loads(self.text[start:end])
+        return self.loaded[key]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def release(self):
+        self.loaded = {}
+
+    def close(self):
+        self.loaded = {}
+        self.text = None
+
+
+# Returns data.raw as LazyDataRaw, or None if the log does not contain it.
+def lazyDataRaw(logFile):
+    text = mapDataRawText(logFile)
+    if text is None:
+        return None
+    return LazyDataRaw(text)
+
+
+# A dict whose values are loaded on first access, e.g. LazyData({'items': lambda: json.load(...)}).
+# Note: Only values that were accessed are part of the dict (when iterating or writing it).
+class LazyData(dict):
+    def __init__(self, loaders):
+        super().__init__()
+        self.loaders = loaders
+
+    def __missing__(self, key):
+        if not key in self.loaders:
+            raise KeyError(key)
+        value = self.loaders.pop(key)()
+        self[key] = value
+        return value
@@ -0,0 +1,5 @@
+# Raised for everything that stops the processing (missing files, invalid paths, missing optional
+# dependencies, ...). The command line tools turn it into an error message and exit code, everyone
+# else (see pipeline.py) can catch it.
+class ScraperError(Exception):
+    pass
@@ -1,8 +1,9 @@
 import os
 import platform
-import sys
 from pathlib import Path
 
+from errors import ScraperError
+
 
 def isPotentialModDir(dir):
     return dir.is_dir() and (dir / 'mod-list.json').is_file()
@@ -77,31 +78,47 @@ def guessGamePath():
     return None
 
 
-def getPaths(args):
+# The cache of the post-processing (rendered icons, parsed locale files) lives in the cache folder
+# of the user, not in the output folder, which is usually deployed as it is.
+def defaultCacheDir():
+    osName = platform.system()
+    if osName == 'Windows' and os.environ.get('LOCALAPPDATA'):
+        base = Path(os.environ['LOCALAPPDATA'])
+    elif osName == 'Darwin':
+        base = Path('~/Library/Caches').expanduser()
+    else:
+        base = Path(os.environ.get('XDG_CACHE_HOME') or Path('~/.cache').expanduser())
+    return (base / 'factorio-data-scraper').resolve()
+
+
+# needsMods: False if the mods folder is not used (e.g. in batch mode every profile has its own)
+def getPaths(args, needsMods=True):
     gamedir = None
     moddir = None
 
     if args.game:
         gamedir = Path(args.game).resolve()
         if not isPotentialGameDir(gamedir):
-            sys.exit(f"ERROR  Invalid game path: {gamedir}")
+            raise ScraperError(f"Invalid game path: {gamedir}")
     
     if args.mods:
         moddir = Path(args.mods).resolve()
         if not isPotentialModDir(moddir):
-            sys.exit(f"ERROR  Invalid mod path: {moddir}")
+            raise ScraperError(f"Invalid mod path: {moddir}")
 
     if not gamedir:
         gamedir = guessGamePath()
         if not gamedir:
-            sys.exit(f"ERROR  Unable to find your factorio install. Please specify the --game argument")
+            raise ScraperError(f"Unable to find your factorio install. Please specify the --game argument")
     
-    if not moddir:
+    if not moddir and needsMods:
         moddir = guessModsPath()
         if not moddir:
-            sys.exit(f"ERROR  Unable to find your mods folder. Please specify the --mods argument")
+            raise ScraperError(f"Unable to find your mods folder. Please specify the --mods argument")
 
     print("\nUsing:")
     print(f"  game = {gamedir}")
-    print(f"  mods = {moddir}\n")
+    if moddir:
+        print(f"  mods = {moddir}")
+    print()
     return {"game": gamedir, "mods": moddir}
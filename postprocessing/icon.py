@@ -1,8 +1,4 @@
 from PIL import Image, ImageChops
-import re
-import zipfile
-import sys
-from pathlib import Path
 import io
 
 # Process the IconSpecification:
@@ -10,38 +6,55 @@ import io
 # iconSpec should contain either 'icon' or 'icons'
 
 outputSize = 64     # @Feature: Make CLI arg
-overflowCounter = 0
-overflowCounterBad = 0
 
-def process(iconSpec, dirs, outputFileName, warn=True):
+
+# Settings and counters of one renderer (see renderer.Worker), nothing is shared between them.
+class RenderState:
+    def __init__(self, layerCache=None, verbose=True):
+        self.layerCache = layerCache    # Optional layercache.LayerCache for the decoded layers
+        self.verbose = verbose          # False to not print warnings about single icons
+        # The renderer sums them up per rendered icon (see renderer.Worker.renderJob)
+        self.overflowCounter = 0
+        self.overflowCounterBad = 0
+
+
+# Returns the 'icon' or 'icons' data of iconSpec, or None if it has neither.
+def originalIconSpec(iconSpec, warn=True):
     if 'icon' in iconSpec:
-        oldIconSpec = iconSpec['icon']
-        image = processSingleIcon(iconSpec, dirs)
+        return iconSpec['icon']
     elif 'icons' in iconSpec:
-        oldIconSpec = iconSpec['icons']
-        image = processMultipleIcons(iconSpec, dirs)
+        return iconSpec['icons']
     else:
         if warn:
             if 'name' in iconSpec:
                 print(f"\nWARN No icon or icons found for {iconSpec['name']}")
             else:
                 print("\nWARN No icon or icons found")
-        return (None, None)
-    
-    iconSpec['icon'] = outputFileName
-    with open(dirs['icons'] / outputFileName, 'wb') as f:
-        image.save(f)
-    return (outputFileName, oldIconSpec)
+        return None
+
+
+# Only the parts of iconSpec that influence the rendered icon. Assumes originalIconSpec(iconSpec) is not None
+def normalizedSpec(iconSpec):
+    if 'icon' in iconSpec:
+        return {'icon': iconSpec['icon'], 'icon_size': iconSpec.get('icon_size')}
+    else:
+        return {'icons': iconSpec['icons'], 'icon_size': iconSpec.get('icon_size')}
+
+
+# Assumes originalIconSpec(iconSpec) is not None
+def render(iconSpec, fs, state):
+    if 'icon' in iconSpec:
+        return processSingleIcon(iconSpec, fs, state)
+    else:
+        return processMultipleIcons(iconSpec, fs, state)
 
 
-def processSingleIcon(iconSpec, dirs):
-    iconSize = iconSpec["icon_size"]    
-    with openImage(iconSpec['icon'], dirs) as image:
-        image = image.crop((0, 0, iconSize, iconSize))
-        return image.resize((outputSize, outputSize))
+def processSingleIcon(iconSpec, fs, state):
+    image = loadSource(iconSpec['icon'], iconSpec["icon_size"], fs, state.layerCache)
+    return image.resize((outputSize, outputSize))
 
 
-def processMultipleIcons(iconSpec, dirs, slack=0):
+def processMultipleIcons(iconSpec, fs, state):
     ## 
     #
     # The Factorio behaviour is as follows: 
@@ -102,8 +115,58 @@ def processMultipleIcons(iconSpec, dirs, slack=0):
     # Then 'implicitScale' converts from the relative (32px-equivalent) size to the real outputSize,
     # i.e everything gets scaled by implicitScale.
     #
+    # The geometry of all layers is planned up front (see planLayout), so the slack needed for
+    # shifted layers that overflow is known before compositing and every icon is composited once.
     ##
 
+    layout = planLayout(iconSpec)
+
+    # Decode, tint and resize every layer exactly once, none of this depends on the slack.
+    prepared = []
+    for layerPlan in layout['layers']:
+        # Applying the tint is independent of scaling.
+        im = loadLayer(layerPlan['icon'], layerPlan['icon_size'], fs, tint=layerPlan['tint'], layerCache=state.layerCache)
+
+        scaledSize = layerPlan['scaledSize']
+        prepared.append(im.resize((int(scaledSize), int(scaledSize))))
+
+    slack = planSlack(iconSpec, layout, [im.getbbox() for im in prepared], state)
+    size = outputSize + slack
+
+    result = Image.new('RGBa', (size, size), (0, 0, 0, 0))
+    for layerPlan, im in zip(layout['layers'], prepared):
+        im = placeLayer(im, layerPlan['scaledSize'], outputSize=size)
+        assert(im.size == result.size)
+
+        if layerPlan['shift']:
+            (leftShift, topShift) = layerPlan['shift']
+            transparent = Image.new('RGBa', result.size, (0, 0, 0, 0))
+            transparent.paste(im, box=(leftShift + slack, topShift + slack))
+            im = transparent
+        
+        result = blend(result, im)
+
+    lostAlpha = layout['lostAlpha']
+    if lostAlpha:
+        bands = result.split()
+        mapToBlack = [0, 0, 0] + [255] * 253
+        mask = bands[0].point(mapToBlack, mode='1')
+        mask = ImageChops.add(mask, bands[1].point(mapToBlack, mode='1'))
+        mask = ImageChops.add(mask, bands[2].point(mapToBlack, mode='1'))
+        mask = ImageChops.subtract(mask, bands[3].point(mapToBlack, mode='1'))
+
+        background = Image.new('RGBa', result.size, color=(0,0,0,0))
+        grey = Image.new('RGBa', result.size, color=(113,113,113,200))
+        background.paste(grey, mask=mask)
+    
+        result = blend(background, result)
+
+    return result.convert('RGBA')
+
+
+# Computes the geometry of all layers from the spec alone, before any image is decoded.
+# Each layer gets its icon_size, the size it is scaled to, its shift in pixels and its tint.
+def planLayout(iconSpec):
     iconSizes = []
     for layer in iconSpec['icons']:
         if 'icon_size' in layer: 
@@ -121,127 +184,127 @@ def processMultipleIcons(iconSpec, dirs, slack=0):
 
     implicitScale = outputSize / requestedSize
 
-    result = Image.new('RGBa', (outputSize + slack, outputSize + slack), (0, 0, 0, 0))
-
+    layers = []
     lostAlpha = False
     for idx, layer in enumerate(iconSpec['icons']):
-        with openImage(layer['icon'], dirs) as im:
-            # Everything in Factorio is using pre-multiplied alpha
-            im = im.convert('RGBa')
-
-            # First crop the image to its real size, making it square and getting rid of mipmaps.
-            im = im.crop((0, 0, iconSizes[idx], iconSizes[idx]))
-
-            # Applying the tint is independent of scaling.
-            if 'tint' in layer:
-                tint = layer['tint']
-                tintAsArray = []
-
-                # Convert {'r','b','g'} into array
-                if isinstance(tint, list):
-                    tintAsArray = tint.copy()
-                else:
-                    for k in ['r','g','b']:
-                        if k in tint:
-                            tintAsArray.append(tint[k])
-                        else:
-                            tintAsArray.append(0)
-                    if 'a' in tint:
-                        tintAsArray.append(tint['a'])
-                
-                # Determine if range is 0-1.0 or 0-255 and normalize to 0-255
-                if max(tintAsArray[0:2]) <= 1.0:
-                    tintAsArray = [int(x * 255) for x in tintAsArray]
-
-                if len(tintAsArray) == 3:
-                    # Default alpha is 255
-                    tintAsArray.append(255)
-                elif len(tintAsArray) == 4 and tintAsArray[3] == 0:
-                    lostAlpha = True
-                    pass
-
-                im = applyTint(im, tintAsArray)
-
-
-            if 'scale' in layer:
-                # im.size[0] * layer['scale'] == size in 32px-equivalent
-                scaledSize = im.size[0] * layer['scale'] * implicitScale
-                im = resizeLayer(im, scaledSize, outputSize=outputSize + slack)
-            else:
-                # If no 'scale': Load as 32px (in 32px-equivalent)
-                scaledSize = 32 * implicitScale
-                im = resizeLayer(im, scaledSize, outputSize=outputSize + slack)
-
-            assert(im.size == result.size)
-
-            if 'shift' in layer:
-                # 'shift' is in 32px-equivalent
-                leftShift = int(layer['shift'][0] * implicitScale)
-                topShift  = int(layer['shift'][1] * implicitScale)               
-
-                if slack == 0:
-                    # Give some slack for icons that barely overflow... 
-                    # This icon business is so f*ing difficult even mod devs don't understand it...
-                    data = im.getbbox()
-                    overflow = 0
-                    direction = ""
-
-                    if data != None:
-                        (left, upper, right, lower) = data
-
-                        if (left + leftShift) < 0:
-                            overflow = max(overflow, abs(left + leftShift))
-                            direction = "left"
-                        if (right + leftShift) > outputSize:
-                            overflow = max(overflow, (right + leftShift) - outputSize)
-                            direction = "right" 
-                        if (upper + topShift) < 0:
-                            overflow = max(overflow, abs(upper + topShift))
-                            direction = "top"
-                        if (lower + topShift) > outputSize:
-                            overflow = max(overflow, (lower + topShift) - outputSize)
-                            direction = "bottom"
-                    
-                    if overflow > 0:
-                        if overflow > 4:
-                            global overflowCounterBad
-                            overflowCounterBad += 1
-                            print(f"\nWARN  Icon overflows by {overflow} on the {direction} ({iconSpec['name']})")
-                        else:
-                            global overflowCounter
-                            overflowCounter += 1
-                        
-                        # Start over with slack...
-                        return processMultipleIcons(iconSpec, dirs, slack=min(4, overflow))
-
-                transparent = Image.new('RGBa', result.size, (0, 0, 0, 0))
-                transparent.paste(im, box=(leftShift + slack, topShift + slack))
-                im = transparent
-            
-            result = blend(result, im)
+        if 'scale' in layer:
+            # icon_size * layer['scale'] == size in 32px-equivalent
+            scaledSize = iconSizes[idx] * layer['scale'] * implicitScale
+        else:
+            # If no 'scale': Load as 32px (in 32px-equivalent)
+            scaledSize = 32 * implicitScale
+
+        shift = None
+        if 'shift' in layer:
+            # 'shift' is in 32px-equivalent
+            shift = (int(layer['shift'][0] * implicitScale), int(layer['shift'][1] * implicitScale))
+
+        tint = None
+        if 'tint' in layer:
+            tint = tintToArray(layer['tint'])
+            if tint[3] == 0:
+                lostAlpha = True
+
+        layers.append({'icon': layer['icon'], 'icon_size': iconSizes[idx], 'scaledSize': scaledSize, 'shift': shift, 'tint': tint})
+
+    return {'implicitScale': implicitScale, 'layers': layers, 'lostAlpha': lostAlpha}
+
+
+# Determines the slack of the final icon, i.e. how much larger it has to be so that shifted layers
+# fit. 'contentBBoxes' are the bounding boxes of the tinted and resized (not yet centered) layers.
+# Overflows are counted in state.
+def planSlack(iconSpec, layout, contentBBoxes, state):
+    for layerPlan, contentBBox in zip(layout['layers'], contentBBoxes):
+        if not layerPlan['shift']:
+            continue
+
+        # Give some slack for icons that barely overflow... 
+        # This icon business is so f*ing difficult even mod devs don't understand it...
+        bbox = centeredBBox(contentBBox, layerPlan['scaledSize'])
+        (overflow, direction) = measureOverflow(bbox, *layerPlan['shift'])
+        if overflow > 0:
+            countOverflow(overflow, direction, iconSpec, state)
+            return min(4, overflow)
+
+    return 0
+
+
+# The bounding box a layer with contentBBox has, when it is centered on a canvas of outputSize.
+def centeredBBox(contentBBox, scaledSize):
+    if contentBBox is None:
+        return None
+
+    offset = int((outputSize - scaledSize) / 2)
+    (left, upper, right, lower) = [min(max(x + offset, 0), outputSize) for x in contentBBox]
+    if left >= right or upper >= lower:
+        return None
+    return (left, upper, right, lower)
+
+
+# Returns by how many pixels (and in which direction) a layer with the given bounding box 
+# overflows the icon when it is shifted by leftShift/topShift.
+def measureOverflow(bbox, leftShift, topShift):
+    overflow = 0
+    direction = ""
+
+    if bbox != None:
+        (left, upper, right, lower) = bbox
+
+        if (left + leftShift) < 0:
+            overflow = max(overflow, abs(left + leftShift))
+            direction = "left"
+        if (right + leftShift) > outputSize:
+            overflow = max(overflow, (right + leftShift) - outputSize)
+            direction = "right" 
+        if (upper + topShift) < 0:
+            overflow = max(overflow, abs(upper + topShift))
+            direction = "top"
+        if (lower + topShift) > outputSize:
+            overflow = max(overflow, (lower + topShift) - outputSize)
+            direction = "bottom"
+
+    return (overflow, direction)
+
+
+def countOverflow(overflow, direction, iconSpec, state):
+    if overflow > 4:
+        state.overflowCounterBad += 1
+        if state.verbose:
+            print(f"\nWARN  Icon overflows by {overflow} on the {direction} ({iconSpec['name']})")
+    else:
+        state.overflowCounter += 1
 
 
-    if lostAlpha:
-        bands = result.split()
-        mapToBlack = [0, 0, 0] + [255] * 253
-        mask = bands[0].point(mapToBlack, mode='1')
-        mask = ImageChops.add(mask, bands[1].point(mapToBlack, mode='1'))
-        mask = ImageChops.add(mask, bands[2].point(mapToBlack, mode='1'))
-        mask = ImageChops.subtract(mask, bands[3].point(mapToBlack, mode='1'))
+# Converts a Types/Color ({'r','g','b','a'} or an array) into [r, g, b, a] in 0-255
+def tintToArray(tint):
+    tintAsArray = []
 
-        background = Image.new('RGBa', result.size, color=(0,0,0,0))
-        grey = Image.new('RGBa', result.size, color=(113,113,113,200))
-        background.paste(grey, mask=mask)
+    # Convert {'r','b','g'} into array
+    if isinstance(tint, list):
+        tintAsArray = tint.copy()
+    else:
+        for k in ['r','g','b']:
+            if k in tint:
+                tintAsArray.append(tint[k])
+            else:
+                tintAsArray.append(0)
+        if 'a' in tint:
+            tintAsArray.append(tint['a'])
     
-        result = blend(background, result)
+    # Determine if range is 0-1.0 or 0-255 and normalize to 0-255
+    if max(tintAsArray[0:2]) <= 1.0:
+        tintAsArray = [int(x * 255) for x in tintAsArray]
 
-    return result.convert('RGBA')
+    if len(tintAsArray) == 3:
+        # Default alpha is 255
+        tintAsArray.append(255)
+
+    return tintAsArray
 
 
-# Resizes image to newSize and centers it on a transparent background of outputSize.
-# => The returned image is of outputSize, with scaled input image at the center!
-def resizeLayer(im, newSize, outputSize):
-    resized = im.resize((int(newSize), int(newSize)))   
+# Centers the (already resized) image on a transparent background of outputSize.
+# => The returned image is of outputSize, with the input image at the center!
+def placeLayer(resized, newSize, outputSize):
     if (newSize == outputSize):
         return resized
     else:
@@ -285,36 +348,59 @@ def blend(dest, src):
     return Image.merge(bands=bands, mode='RGBa')
 
 
-def openImage(path, dirs):
-    parts = re.split(r'__(.*)__/', path)[1:]
-    assert(len(parts) == 2)
-    
-    mod = parts[0]
-    relativePath = parts[1]
-    
-    if mod == "base" or mod == "core":
-        modDir = dirs['game'] / 'data' / mod
-    else:
-        modDir = dirs['mods'] / mod
+# Returns the layer as premultiplied RGBa, cropped to iconSize (getting rid of the mipmaps) 
+# and optionally tinted. Uses layerCache (layercache.LayerCache) if there is one.
+def loadLayer(path, iconSize, fs, tint=None, layerCache=None):
+    # Everything in Factorio is using pre-multiplied alpha
+    im = loadSource(path, iconSize, fs, layerCache).convert('RGBa')
 
-    image = None
-    if modDir.is_dir():
-        image = Image.open(modDir / relativePath)
-    else:
-        # @Incomplete: This just guesses the mod version, bad if 2 versions are there.
-        modDir = list(modDir.parent.glob(f'{mod}*.zip'))[0] 
-        if zipfile.is_zipfile(modDir):
-            modZip = zipfile.ZipFile(modDir, 'r') 
-            resultBytes = io.BytesIO(modZip.read(modDir.stem + "/" + relativePath))
-            image = Image.open(resultBytes)
+    if tint:
+        if layerCache is not None and layerCache.cacheTinted:
+            (mod, relativePath) = fs.splitPath(path)
+            key = (str(fs.modPath(mod)), relativePath, iconSize, 0, tuple(tint))
+            untinted = im
+            im = layerCache.get(key, lambda: applyTint(untinted, tint))
         else:
-            sys.exit("ERROR  Failed to access mod '{}': It is neither a .zip file nor a folder")
+            im = applyTint(im, tint)
+    return im
+
+
+# Returns the image as RGBA, cropped to iconSize. Single icons use it as it is, so they are not
+# changed by the conversion to premultiplied alpha and back (see loadLayer).
+def loadSource(path, iconSize, fs, layerCache=None):
+    def decode():
+        with openImage(path, fs) as im:
+            # First crop the image to its real size, making it square and getting rid of mipmaps.
+            return im.crop((0, 0, iconSize, iconSize))
+
+    if layerCache is None:
+        return decode()
+
+    (mod, relativePath) = fs.splitPath(path)
+    return layerCache.get((str(fs.modPath(mod)), relativePath, iconSize, 0), decode)
+
+
+def openImage(path, fs):
+    (mod, relativePath) = fs.splitPath(path)
+
+    filePath = fs.filePath(mod, relativePath)
+    if filePath:
+        image = Image.open(filePath)
+    else:
+        image = Image.open(io.BytesIO(fs.read(mod, relativePath)))
 
     return image.convert('RGBA')
 
 
-def reportOverFlow():
-    if overflowCounter > 0:
-        print(f"\nINFO  {overflowCounter} icon(s) overflowed, but were fixed")
-    if overflowCounterBad > 0:
-        print(f"WARN  {overflowCounterBad} icon(s) overflowed badly (>4 pixels) and were clipped...")
\ No newline at end of file
+# Something that changes whenever the image behind path changes, without reading the image itself.
+def sourceIdentity(path, fs):
+    (mod, relativePath) = fs.splitPath(path)
+    return fs.identity(mod, relativePath)
+
+
+# stats: IconRenderer.stats
+def reportOverFlow(stats):
+    if stats['overflows'] > 0:
+        print(f"\nINFO  {stats['overflows']} icon(s) overflowed, but were fixed")
+    if stats['overflowsBad'] > 0:
+        print(f"WARN  {stats['overflowsBad']} icon(s) overflowed badly (>4 pixels) and were clipped...")
\ No newline at end of file
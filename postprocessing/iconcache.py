@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import shutil
+
+from PIL import Image
+
+import icon
+
+# Content-addressed on-disk cache for rendered icons.
+#
+# The key of an icon is a hash over everything that influences the rendered result:
+#   - the normalized IconSpecification (without the prototype name)
+#   - icon.outputSize
+#   - the identity of every source layer (path + mtime/size, or the CRC of the zip member)
+# So after a mod update only the icons whose layers really changed have to be rendered again.
+
+# Bump this whenever the rendering itself changes, this invalidates all existing entries.
+CACHE_VERSION = 2
+
+class IconCache:
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+        self.cacheDir.mkdir(parents=True, exist_ok=True)
+
+
+    def key(self, iconSpec, fs):
+        spec = icon.normalizedSpec(iconSpec)
+        if 'icon' in spec:
+            paths = [spec['icon']]
+        else:
+            paths = [layer['icon'] for layer in spec['icons']]
+
+        sources = [icon.sourceIdentity(path, fs) for path in paths]
+        keyData = json.dumps([CACHE_VERSION, icon.outputSize, spec, sources], sort_keys=True)
+        return hashlib.sha256(keyData.encode('utf-8')).hexdigest()
+
+
+    def path(self, key):
+        return self.cacheDir / key[0:2] / (key + '.png')
+
+
+    # Places the cached icon at outputPath, returns False if there is no such entry.
+    def fetch(self, key, outputPath):
+        cached = self.path(key)
+        if not cached.is_file():
+            return False
+        placeFile(cached, outputPath)
+        return True
+
+
+    # Returns the cached icon as RGBA image, or None if there is no such entry.
+    def load(self, key):
+        cached = self.path(key)
+        if not cached.is_file():
+            return None
+        with Image.open(cached) as image:
+            return image.convert('RGBA')
+
+
+    # Stores the image and (optionally) places it at outputPath
+    def store(self, key, image, outputPath=None):
+        cached = self.path(key)
+        cached.parent.mkdir(exist_ok=True)
+
+        # Write to a temporary file first, other workers might store the same key concurrently.
+        tmpFile = cached.with_name(f"{key}.{os.getpid()}.tmp")
+        with open(tmpFile, 'wb') as f:
+            image.save(f, format='PNG')
+        os.replace(tmpFile, cached)
+
+        if outputPath:
+            placeFile(cached, outputPath)
+
+
+# Hardlinks src to dest (falls back to copying, e.g. across filesystems).
+def placeFile(src, dest):
+    # Never write into dest: it might be a hardlink into the cache from a previous run!
+    if dest.exists():
+        dest.unlink()
+
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
@@ -0,0 +1,242 @@
+import functools
+
+from PIL import Image
+
+import icon
+from errors import ScraperError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Renders icons with multiple layers on numpy arrays, batched over many icons (see
+# icon.processMultipleIcons for the Factorio icon rules, they are exactly the same here).
+#
+# This is not used by the scraper itself: The vectorized blend is faster than ImageChops, but the
+# bicubic resize as a dense matrix product is slower than PIL's C resampling and that is where most
+# of the time goes, so all in all it renders about half as fast as the PIL code. It is meant for
+# callers working on arrays anyway, e.g. iconnumpy.processBatch(iconSpecs, fs, icon.RenderState()).
+#
+# The geometry comes from icon.planLayout/planSlack as well. PIL only decodes the layers
+# (icon.loadLayer, without tint), everything else works on premultiplied RGBa arrays:
+#   - all layers of the batch with the same icon_size and scaled size are tinted and resized together
+#                                                               -> (layers, iconSize, iconSize, 4)
+#     The tint has to be applied before resizing, the resampling filter clips, so tinting and
+#     resizing don't commute.
+#   - the layers of an icon are placed (centered + shifted) on a stack of canvases
+#                                                               -> (layers, size, size, 4)
+#   - the stacks of all icons with the same size (and number of layers) are blended with the 'over' operator in one go
+#                                                               -> (icons, layers, size, size, 4)
+# The integer arithmetic is the same as the one of PIL (ImageChops.multiply truncates, add clips,
+# the bicubic resize uses the fixed point coefficients of Pillow's Resample.c), so the result is
+# identical to icon.processMultipleIcons (see tests/test_iconnumpy.py).
+
+# Pillow's resampling works with fixed point coefficients of this many bits
+PRECISION_BITS = 22
+
+def checkAvailable():
+    if np is None:
+        raise ScraperError("iconnumpy needs numpy, install it with: pip install numpy")
+
+
+# state: icon.RenderState
+def processMultipleIcons(iconSpec, fs, state):
+    return processBatch([iconSpec], fs, state)[0]
+
+# Renders several icons with multiple layers, returns the images in the same order.
+def processBatch(iconSpecs, fs, state):
+    checkAvailable()
+    layouts = [icon.planLayout(iconSpec) for iconSpec in iconSpecs]
+    resizedLayers = prepareLayers(layouts, fs, state)
+    return compositeBatch([placeLayers(iconSpec, layout, resized, state)
+                           for (iconSpec, layout, resized) in zip(iconSpecs, layouts, resizedLayers)])
+
+
+# Decodes, tints and resizes the layers of all layouts, every layer is decoded exactly once.
+# Returns the resized layers (scaledSize, scaledSize, 4) as one list per layout.
+def prepareLayers(layouts, fs, state):
+    groups = {}
+    for (layoutIdx, layout) in enumerate(layouts):
+        for (layerIdx, layerPlan) in enumerate(layout['layers']):
+            key = (layerPlan['icon_size'], int(layerPlan['scaledSize']))
+            groups.setdefault(key, []).append((layoutIdx, layerIdx, layerPlan))
+
+    resizedLayers = [[None] * len(layout['layers']) for layout in layouts]
+    for ((iconSize, scaledSize), entries) in groups.items():
+        pixels = np.stack([np.asarray(icon.loadLayer(layerPlan['icon'], iconSize, fs, layerCache=state.layerCache))
+                           for (_, _, layerPlan) in entries])
+        tints = np.array([layerPlan['tint'] or [255] * 4 for (_, _, layerPlan) in entries], dtype=np.uint16)
+        tinted = applyTint(pixels, tints)
+        resized = resize(tinted, scaledSize)
+        for (pos, (layoutIdx, layerIdx, _)) in enumerate(entries):
+            resizedLayers[layoutIdx][layerIdx] = resized[pos]
+    return resizedLayers
+
+
+# Places the resized layers of an icon on canvases of the final size.
+# Returns {'stack': (layers, size, size, 4), 'lostAlpha'}, the overflow is counted in state.
+def placeLayers(iconSpec, layout, resizedLayers, state):
+    layers = layout['layers']
+    slack = icon.planSlack(iconSpec, layout, [alphaBBox(pixels) for pixels in resizedLayers], state)
+
+    size = icon.outputSize + slack
+    stack = np.zeros((len(layers), size, size, 4), dtype=np.uint8)
+    for idx, (layerPlan, pixels) in enumerate(zip(layers, resizedLayers)):
+        scaledSize = layerPlan['scaledSize']
+        if scaledSize == size:
+            centered = pixels
+        else:
+            offset = centerOffset(scaledSize, size)
+            centered = np.zeros((size, size, 4), dtype=np.uint8)
+            paste(centered, pixels, offset, offset)
+
+        if layerPlan['shift']:
+            (leftShift, topShift) = layerPlan['shift']
+            paste(stack[idx], centered, leftShift + slack, topShift + slack)
+        else:
+            stack[idx] = centered
+
+    return {'stack': stack, 'lostAlpha': layout['lostAlpha']}
+
+
+# Same as icon.applyTint for a stack of layers (layers, size, size, 4) with one tint per layer.
+# A tint of 255 keeps the channel as it is.
+def applyTint(pixels, tints):
+    return (pixels * tints[:, np.newaxis, np.newaxis, :]) // 255
+
+
+# Same as PIL's getbbox of an RGBa image (which only looks at the alpha channel):
+# (left, upper, right, lower) of the pixels with alpha or None if there are none.
+def alphaBBox(pixels):
+    alpha = pixels[..., 3] > 0
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if len(rows) == 0:
+        return None
+    columns = np.flatnonzero(alpha.any(axis=0))
+    return (int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1)
+
+
+# Same as Image.resize (bicubic) for a stack of square layers (layers, size, size, 4):
+# resizes horizontally and then vertically, rounding and clipping to bytes after each pass.
+# Returns uint8.
+def resize(pixels, size):
+    inSize = pixels.shape[-2]
+    if inSize == size:
+        return pixels.astype(np.uint8)
+
+    coefficients = resizeCoefficients(inSize, size)
+    # (layers, h, w, 4) -> (layers, h, 4, w) @ (w, size) -> (layers, h, 4, size)
+    horizontal = roundPass(np.matmul(np.swapaxes(pixels, -1, -2).astype(np.float64), coefficients.T))
+    # (size, h) @ (layers, h, size * 4) -> (layers, size, size * 4)
+    vertical = roundPass(np.matmul(coefficients, np.swapaxes(horizontal, -1, -2).reshape(-1, inSize, size * 4)))
+    return vertical.reshape(len(pixels), size, size, 4).astype(np.uint8)
+
+# The sums are integers below 2^53, so float64 is exact here.
+def roundPass(sums):
+    return np.clip(np.floor((sums + (1 << (PRECISION_BITS - 1))) / (1 << PRECISION_BITS)), 0, 255)
+
+# The (outSize, inSize) matrix of the fixed point bicubic coefficients, see precompute_coeffs
+# and normalize_coeffs_8bpc in Pillow's Resample.c.
+@functools.lru_cache(maxsize=None)
+def resizeCoefficients(inSize, outSize):
+    scale = inSize / outSize
+    filterScale = max(scale, 1.0)
+    support = 2.0 * filterScale
+
+    coefficients = np.zeros((outSize, inSize))
+    for outX in range(outSize):
+        center = (outX + 0.5) * scale
+        xMin = max(int(center - support + 0.5), 0)
+        xMax = min(int(center + support + 0.5), inSize)
+        weights = [bicubic((x + xMin - center + 0.5) / filterScale) for x in range(xMax - xMin)]
+        total = sum(weights)
+        for (x, weight) in enumerate(weights):
+            k = weight / total if total != 0 else weight
+            coefficients[outX, xMin + x] = int((0.5 if k >= 0 else -0.5) + k * (1 << PRECISION_BITS))
+    return coefficients
+
+def bicubic(x):
+    a = -0.5
+    x = abs(x)
+    if x < 1.0:
+        return ((a + 2.0) * x - (a + 3.0)) * x * x + 1
+    if x < 2.0:
+        return (((x - 5) * x + 8) * x - 4) * a
+    return 0.0
+
+
+# Blends the prepared icons (see placeLayers), icons with the same size and number of layers are
+# blended together.
+def compositeBatch(prepared):
+    groups = {}
+    for idx, entry in enumerate(prepared):
+        groups.setdefault(entry['stack'].shape[0:2], []).append(idx)
+
+    images = [None] * len(prepared)
+    for ((layerCount, size), indices) in groups.items():
+        results = blendStack(np.stack([prepared[idx]['stack'] for idx in indices]))
+
+        lostAlpha = np.array([prepared[idx]['lostAlpha'] for idx in indices])
+        if lostAlpha.any():
+            results[lostAlpha] = addGreyBackground(results[lostAlpha])
+
+        for (pos, idx) in enumerate(indices):
+            images[idx] = Image.frombytes('RGBa', (size, size), results[pos].tobytes()).convert('RGBA')
+    return images
+
+
+# Same as icon.placeLayer
+def centerOffset(scaledSize, canvasSize):
+    return int((canvasSize - scaledSize) / 2)
+
+
+# Same as PIL's paste: Copies src into dest at (left, top) and clips everything outside of dest.
+def paste(dest, src, left, top):
+    (destHeight, destWidth) = dest.shape[0:2]
+    (srcHeight, srcWidth) = src.shape[0:2]
+
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(left + srcWidth, destWidth), min(top + srcHeight, destHeight)
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    dest[y0:y1, x0:x1] = src[y0 - top:y1 - top, x0 - left:x1 - left]
+
+
+# Blends src over dest (premultiplied alpha): RGB_src + RGB_dest * (1 - alpha_src)
+# Both can have any number of leading dimensions, e.g. (icons, size, size, 4).
+def blend(dest, src):
+    result = dest.astype(np.uint16)
+    blendInto(result, src)
+    return result.astype(np.uint8)
+
+# Blends all layers of stack (..., layers, size, size, 4) on top of each other, first layer at the bottom.
+def blendStack(stack):
+    result = np.zeros(stack.shape[:-4] + stack.shape[-3:], dtype=np.uint16)
+    for idx in range(stack.shape[-4]):
+        blendInto(result, stack[..., idx, :, :, :])
+    return result.astype(np.uint8)
+
+# Blends src over result in place, result is uint16 (but always in 0-255) to avoid conversions.
+def blendInto(result, src):
+    src = src.astype(np.uint16)
+    result *= 255 - src[..., 3:4]
+    # Same as result //= 255 (truncating like ImageChops.multiply), but without a division:
+    # exact for all products of two bytes.
+    result += 1 + (result >> 8)
+    result >>= 8
+    # ImageChops.add clips
+    result += src
+    np.minimum(result, 255, out=result)
+
+
+# Same as the lostAlpha handling in icon.processMultipleIcons: Pixels with color but without
+# alpha get a grey background, otherwise they would be invisible.
+def addGreyBackground(pixels):
+    visible = pixels > 2
+    mask = visible[..., 0:3].any(axis=-1) & ~visible[..., 3]
+
+    background = np.zeros_like(pixels)
+    background[mask] = (113, 113, 113, 200)
+    return blend(background, pixels)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+
+import icon
+
+# Incremental mode: Only the prototypes that changed since the previous run are localised and
+# get their icons rendered.
+#
+# incremental.json (next to the output) stores a hash of every prototype, the icon file it got and
+# its resolved localised strings. The hash covers everything the output of a prototype depends on:
+# its script output entry (with the unresolved localised strings), its data.raw entry and the
+# identities of its icon layers. If the hash of a prototype did not change:
+#   - its icon file is kept as it is (pinned) instead of being rendered and placed again
+#   - its localised strings are taken from the manifest, as long as the locale strings themselves
+#     did not change either (see Localisation.fingerprint). Strings that can't be resolved only
+#     warn in the run that resolved them.
+# Changed prototypes get the same file names as before whenever possible. Icon files of the
+# previous run that are not used anymore (removed prototypes, changed icons) are deleted at the end.
+#
+# Everything else is processed as usual. Atlas mode is not supported, the atlas sheets are rebuilt
+# from scratch anyway.
+
+MANIFEST_VERSION = 2
+
+class IncrementalBuild:
+    # localisations: {locale: Localisation} of the run (see processing.prepare), None without the locale stage
+    def __init__(self, dirs, options, localisations=None):
+        self.manifestFile = dirs['output'] / 'incremental.json'
+        self.iconDir = dirs['icons']
+        self.fs = None
+        self.settings = {'version': MANIFEST_VERSION, 'outputSize': icon.outputSize}
+        self.locales = {locale: loc.fingerprint() for (locale, loc) in localisations.items()} if localisations else None
+
+        self.previous = {'prototypes': {}, 'icons': {}, 'locales': None}
+        if self.manifestFile.is_file():
+            try:
+                with open(self.manifestFile, 'r') as f:
+                    manifest = json.load(f)
+                if manifest.get('settings') == self.settings:
+                    self.previous = manifest
+                else:
+                    print("INFO  The settings changed since the previous run, rebuilding everything")
+            except (OSError, ValueError):
+                print(f"WARN  Unable to read {self.manifestFile}, rebuilding everything")
+
+        # The strings of the previous run are only reused if they were resolved with the same locale strings
+        self.reuseStrings = self.locales is not None and self.previous['locales'] == self.locales
+
+        self.prototypes = {}    # owner -> {'hash', 'icon', 'localised': {field: {locale: string}}}
+        self.unchangedCounter = 0
+
+
+    # Lets the renderer reuse the files of the previous run (see IconRenderer.schedule)
+    def attach(self, renderer, fs):
+        self.fs = fs
+        renderer.incremental = self
+        renderer.previousFiles = {specHash: fileName for (fileName, specHash) in self.previous['icons'].items()}
+        renderer.fileUsers = {}
+        for (owner, entry) in self.previous['prototypes'].items():
+            if entry['icon']:
+                renderer.fileUsers.setdefault(entry['icon'], set()).add(owner)
+
+
+    # Returns the entry of the previous run (see self.prototypes) if the prototype did not change, else None.
+    # obj is the prototype before it is localised, rawObj its data.raw entry.
+    def check(self, owner, obj, rawObj):
+        prototypeHash = self.hash(obj, rawObj)
+        self.prototypes[owner] = {'hash': prototypeHash, 'icon': None, 'localised': {}}
+
+        previous = self.previous['prototypes'].get(owner)
+        if previous and previous['hash'] == prototypeHash:
+            self.unchangedCounter += 1
+            return previous
+        return None
+
+    def record(self, owner, fileName):
+        self.prototypes[owner]['icon'] = fileName
+
+
+    # The strings of obj[field] from the previous run (previous: see check), None if they have to be resolved again.
+    def previousStrings(self, previous, field):
+        if previous is None or not self.reuseStrings:
+            return None
+        return previous['localised'].get(field)
+
+    def recordStrings(self, owner, field, resolved):
+        self.prototypes[owner]['localised'][field] = resolved
+
+
+    def hash(self, obj, rawObj):
+        sources = []
+        if icon.originalIconSpec(rawObj, warn=False) is not None:
+            spec = icon.normalizedSpec(rawObj)
+            paths = [spec['icon']] if 'icon' in spec else [layer['icon'] for layer in spec['icons']]
+            for path in paths:
+                try:
+                    sources.append(icon.sourceIdentity(path, self.fs))
+                except (FileNotFoundError, KeyError, AssertionError):
+                    sources.append(None)
+
+        keyData = json.dumps([obj, rawObj, sources], sort_keys=True, default=str)
+        return hashlib.sha256(keyData.encode('utf-8')).hexdigest()
+
+
+    # Deletes the icon files that are not used anymore and writes the manifest for the next run.
+    def finish(self, renderer):
+        icons = {fileName: specHash for (specHash, fileName) in renderer.filesBySpec.items()}
+
+        removed = 0
+        for fileName in self.previous['icons']:
+            if not fileName in icons and (self.iconDir / fileName).is_file():
+                (self.iconDir / fileName).unlink()
+                removed += 1
+
+        changed = len(self.prototypes) - self.unchangedCounter
+        print(f"INFO  Incremental: {changed} of {len(self.prototypes)} prototype(s) changed, removed {removed} unused icon(s)")
+
+        manifest = {'settings': self.settings, 'locales': self.locales, 'prototypes': self.prototypes, 'icons': icons}
+        tmpFile = self.manifestFile.with_name(f"{self.manifestFile.name}.{os.getpid()}.tmp")
+        with open(tmpFile, 'w') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        os.replace(tmpFile, self.manifestFile)
@@ -0,0 +1,76 @@
+# Reverse lookups which every consumer of output.json would have to build otherwise.
+# Each of them is a single pass over the processed data:
+#
+#   'produced_by':       {'item'|'fluid': {name: [recipes]}}
+#   'consumed_by':       {'item'|'fluid': {name: [recipes]}}
+#   'crafting_machines': {crafting category: [entities]}
+#   'fuels':             {fuel category: [items]}
+#   'next_upgrade':      {entity: entity it is upgraded to}
+#   'upgrade_chains':    [[entity, next_upgrade, next_upgrade of that, ...], ...]
+
+def buildIndexes(data):
+    nextUpgrade = nextUpgrades(data['entities'], data['raw'])
+    return {
+        'produced_by':       recipesByProduct(data['recipes'], 'products'),
+        'consumed_by':       recipesByProduct(data['recipes'], 'ingredients'),
+        'crafting_machines': machinesByCategory(data['entities']),
+        'fuels':             fuelsByCategory(data['items']),
+        'next_upgrade':      nextUpgrade,
+        'upgrade_chains':    upgradeChains(nextUpgrade),
+    }
+
+
+# key is 'products' or 'ingredients'
+def recipesByProduct(recipes, key):
+    result = {'item': {}, 'fluid': {}}
+    for recipe in recipes.values():
+        for product in recipe[key]:
+            recipesOfProduct = result.setdefault(product['type'], {}).setdefault(product['name'], [])
+            # A recipe can list the same product more than once
+            if not recipesOfProduct or recipesOfProduct[-1] != recipe['name']:
+                recipesOfProduct.append(recipe['name'])
+    return result
+
+
+def machinesByCategory(entities):
+    result = {}
+    for entitiesOfKind in entities.values():
+        for entity in entitiesOfKind.values():
+            for category in (entity.get('crafting_categories') or {}):
+                result.setdefault(category, []).append(entity['name'])
+    return result
+
+
+def fuelsByCategory(items):
+    result = {}
+    for item in items.values():
+        if 'fuel' in item:
+            result.setdefault(item['fuel']['fuel_category'], []).append(item['name'])
+    return result
+
+
+# next_upgrade is not part of the script output, it comes from data.raw
+def nextUpgrades(entities, raw):
+    result = {}
+    for entitiesOfKind in entities.values():
+        for (key, entity) in entitiesOfKind.items():
+            nextUpgrade = raw[entity['type']][key].get('next_upgrade')
+            if nextUpgrade:
+                result[entity['name']] = nextUpgrade
+    return result
+
+
+# Follows next_upgrade from every entity that is not the upgrade of another one.
+def upgradeChains(nextUpgrade):
+    upgraded = set(nextUpgrade.values())
+    chains = []
+    for start in nextUpgrade:
+        if start in upgraded:
+            continue
+        chain = [start]
+        visited = {start}
+        while chain[-1] in nextUpgrade and not nextUpgrade[chain[-1]] in visited:
+            chain.append(nextUpgrade[chain[-1]])
+            visited.add(chain[-1])
+        chains.append(chain)
+    return chains
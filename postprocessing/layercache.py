@@ -0,0 +1,76 @@
+from collections import OrderedDict
+
+# In-memory LRU cache for the source layers of icons.
+#
+# Lots of icons are built from the same images (barrels, tier overlays, ore icons in compound
+# icons, ...). Instead of decoding the full PNG (with all its mipmaps) for every use, the decoded
+# and cropped RGBA image is kept here, bounded by the number of bytes of all entries. Single icons
+# and layers share it, the layers are premultiplied on use (see icon.loadLayer).
+# Optionally the tinted (premultiplied) variants are cached as well.
+#
+# Keys are (resolved mod path, relative path, icon_size, mipmap level, tint).
+# The cached images are shared, so callers must not modify them (PIL operations return copies).
+
+class LayerCache:
+    def __init__(self, maxBytes, cacheTinted=False):
+        self.maxBytes = maxBytes
+        self.cacheTinted = cacheTinted
+        self.entries = OrderedDict()    # key -> image
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    # Returns the cached image for key, or calls load() and caches its result.
+    def get(self, key, load):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        image = load()
+
+        size = imageBytes(image)
+        if size <= self.maxBytes:
+            self.entries[key] = image
+            self.bytes += size
+            while self.bytes > self.maxBytes:
+                (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= imageBytes(evicted)
+                self.evictions += 1
+
+        return image
+
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.entries), 'bytes': self.bytes}
+
+
+# Returns a cache for the options of a run ('layerCacheMB', 'cacheTintedLayers'), or None if it is disabled.
+def createLayerCache(options):
+    if options['layerCacheMB'] <= 0:
+        return None
+    return LayerCache(options['layerCacheMB'] * 1024 * 1024, cacheTinted=options['cacheTintedLayers'])
+
+
+def imageBytes(image):
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+# Merges the stats of several caches (e.g. one per worker process) and prints them.
+def reportStats(statsList):
+    if not statsList:
+        return
+
+    total = {k: sum(stats[k] for stats in statsList) for k in statsList[0]}
+    lookups = total['hits'] + total['misses']
+    if lookups == 0:
+        return
+
+    hitRate = 100.0 * total['hits'] / lookups
+    print(f"INFO  Layer cache: {total['hits']}/{lookups} hits ({hitRate:.1f}%), {total['evictions']} evictions, "
+          f"{total['entries']} layers using {total['bytes'] / (1024 * 1024):.1f} MB")
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import marshal
+import sqlite3
+import time
+
+# On-disk store for the parsed locale files, so they don't have to be parsed on every run.
+#
+# Every mod gets one row per locale with its parsed strings ({category: {key: string}}, as marshal
+# blob), together with a fingerprint of the mod version and the identity (mtime/size or CRC, see
+# ModFileSystem.identity) of all its locale files. A mod is only parsed again if its fingerprint
+# changed. On top of that the merged table of all mods is stored as well, keyed by the
+# fingerprints of all mods in load order, so a run without any changes just loads a single blob.
+#
+# Several versions of a mod (and merged tables of several mod sets) are kept side by side, so
+# different mod sets sharing the cache (batch profiles, switching between modpacks) don't evict
+# each other. Rows that were not used for MAX_AGE_DAYS are deleted.
+
+# Bump this whenever the parsing of the locale files changes, this invalidates all existing rows.
+LOCALE_CACHE_VERSION = 3
+
+MAX_AGE_DAYS = 30
+
+class LocaleCache:
+    def __init__(self, cacheDir):
+        cacheDir.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(cacheDir / 'locale.sqlite')
+        self.used = {'mods': set(), 'merged': set()}    # keys of the rows used by this run
+        with self.db:
+            if self.db.execute('PRAGMA user_version').fetchone()[0] != LOCALE_CACHE_VERSION:
+                self.db.execute('DROP TABLE IF EXISTS mods')
+                self.db.execute('DROP TABLE IF EXISTS merged')
+                self.db.execute(f'PRAGMA user_version = {LOCALE_CACHE_VERSION}')
+            self.db.execute('CREATE TABLE IF NOT EXISTS mods (locale TEXT, mod TEXT, fingerprint TEXT, data BLOB, '
+                            'used REAL, PRIMARY KEY (locale, mod, fingerprint))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS merged (locale TEXT, fingerprint TEXT, data BLOB, '
+                            'used REAL, PRIMARY KEY (locale, fingerprint))')
+
+
+    def fingerprint(self, fs, modName, fileNames):
+        return modFingerprint(fs, modName, fileNames)
+
+    def mergedFingerprint(self, fingerprints):
+        return mergedFingerprint(fingerprints)
+
+
+    # Returns the parsed strings of the mod, or None if there are none with that fingerprint.
+    def loadMod(self, locale, modName, fingerprint):
+        row = self.db.execute('SELECT data FROM mods WHERE locale = ? AND mod = ? AND fingerprint = ?',
+                              (locale, modName, fingerprint)).fetchone()
+        if row is None:
+            return None
+        self.used['mods'].add((locale, modName, fingerprint))
+        return marshal.loads(row[0])
+
+    def storeMod(self, locale, modName, fingerprint, data):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO mods VALUES (?, ?, ?, ?, ?)',
+                            (locale, modName, fingerprint, marshal.dumps(data), time.time()))
+
+
+    def loadMerged(self, locale, fingerprint):
+        row = self.db.execute('SELECT data FROM merged WHERE locale = ? AND fingerprint = ?',
+                              (locale, fingerprint)).fetchone()
+        if row is None:
+            return None
+        self.used['merged'].add((locale, fingerprint))
+        return marshal.loads(row[0])
+
+    def storeMerged(self, locale, fingerprint, data):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO merged VALUES (?, ?, ?, ?)',
+                            (locale, fingerprint, marshal.dumps(data), time.time()))
+
+
+    # Marks the rows of this run as used and deletes the ones that were not used for a long time.
+    def close(self):
+        now = time.time()
+        try:
+            with self.db:
+                self.db.executemany('UPDATE mods SET used = ? WHERE locale = ? AND mod = ? AND fingerprint = ?',
+                                    [(now,) + key for key in self.used['mods']])
+                self.db.executemany('UPDATE merged SET used = ? WHERE locale = ? AND fingerprint = ?',
+                                    [(now,) + key for key in self.used['merged']])
+                oldest = now - MAX_AGE_DAYS * 24 * 3600
+                self.db.execute('DELETE FROM mods WHERE used < ?', (oldest,))
+                self.db.execute('DELETE FROM merged WHERE used < ?', (oldest,))
+        except sqlite3.Error as e:
+            print(f"WARN  Unable to update the locale cache ({e})")
+        finally:
+            self.db.close()
+
+
+def modFingerprint(fs, modName, fileNames):
+    sources = [fs.identity(modName, fileName) for fileName in fileNames]
+    keyData = json.dumps([LOCALE_CACHE_VERSION, modName, fs.versions.get(modName, ''), sources])
+    return hashlib.sha256(keyData.encode('utf-8')).hexdigest()
+
+def mergedFingerprint(fingerprints):
+    return hashlib.sha256('\n'.join(fingerprints).encode('utf-8')).hexdigest()
+
+
+# Returns the LocaleCache in cacheDir, or None if caching is disabled or the database is unusable.
+def openLocaleCache(cacheDir):
+    if cacheDir is None:
+        return None
+    try:
+        return LocaleCache(cacheDir)
+    except sqlite3.Error as e:
+        print(f"WARN  Unable to open the locale cache, parsing all locale files ({e})")
+        return None
+
+
+# Keeps the parsed locale files in memory, for processing several times in the same process
+# (see pipeline.py): core and base are only parsed (or loaded) once, no matter how many mod sets
+# use them. backing is an optional LocaleCache which is asked on a miss and stored into as well,
+# it can be exchanged between runs. close() only closes the backing cache.
+# The returned data is shared, so it must not be modified.
+class MemoryLocaleCache:
+    def __init__(self, backing=None):
+        self.backing = backing
+        self.mods = {}      # (locale, mod, fingerprint) -> data
+        self.merged = {}    # (locale, fingerprint) -> data
+
+
+    def fingerprint(self, fs, modName, fileNames):
+        return modFingerprint(fs, modName, fileNames)
+
+    def mergedFingerprint(self, fingerprints):
+        return mergedFingerprint(fingerprints)
+
+
+    def loadMod(self, locale, modName, fingerprint):
+        key = (locale, modName, fingerprint)
+        if not key in self.mods and self.backing:
+            data = self.backing.loadMod(locale, modName, fingerprint)
+            if data is not None:
+                self.mods[key] = data
+        return self.mods.get(key)
+
+    def storeMod(self, locale, modName, fingerprint, data):
+        self.mods[(locale, modName, fingerprint)] = data
+        if self.backing:
+            self.backing.storeMod(locale, modName, fingerprint, data)
+
+
+    def loadMerged(self, locale, fingerprint):
+        key = (locale, fingerprint)
+        if not key in self.merged and self.backing:
+            data = self.backing.loadMerged(locale, fingerprint)
+            if data is not None:
+                self.merged[key] = data
+        return self.merged.get(key)
+
+    def storeMerged(self, locale, fingerprint, data):
+        self.merged[(locale, fingerprint)] = data
+        if self.backing:
+            self.backing.storeMerged(locale, fingerprint, data)
+
+
+    def close(self):
+        if self.backing:
+            self.backing.close()
+            self.backing = None
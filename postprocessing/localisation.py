@@ -1,28 +1,58 @@
-import os
+import hashlib
+import json
+import marshal
 import re
-import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Parameters (__1__) and the hardcoded references to other prototypes (__ENTITY__boiler__) in localised strings
+TEMPLATE_PLACEHOLDER = re.compile(r'__(\d+)__|__(ENTITY|ITEM|TILE|FLUID|CONTROL)__(.+?)__')
+
+# Locale category of the names that the hardcoded references are replaced with
+TEMPLATE_REFERENCES = {'ENTITY': 'entity-name', 'ITEM': 'item-name', 'TILE': 'tile-name', 'FLUID': 'fluid-name',
+                       'CONTROL': 'controls'}
+
+EMPTY_CATEGORY = "no-category"
+
+# Number of threads reading the locale files of the mods
+LOCALE_THREADS = 8
 
 class Localisation:
-    def __init__(self, dirs, locale='en'):
+    # cache: Optional LocaleCache, only mods whose locale files changed are parsed again.
+    # data: The already loaded strings of the locale (see loadLocalisations), skips loading them.
+    # fallback: Localisation used for strings that don't exist in this locale.
+    def __init__(self, fs, locale='en', cache=None, data=None, fallback=None):
         self.locale = locale        
-        self.EMPTY_CATEGORY = "no-category"
-        self.dataPerMod = self.crawlLocalisation(dirs)
-        self.data = {}
+        self.fallback = fallback
+        if data is None:
+            data = loadLocaleData(fs, [locale], cache)[locale]
+        self.data = data
+        self.templates = {}     # (category, key) -> compiled template (see compileTemplate)
+        self.resolved = {}      # hashableResource -> resolved string
+        self.dataHash = None    # see fingerprint
 
-        for arr in self.dataPerMod.values():
-            for category, items in arr.items():
-                if not category in self.data:
-                    self.data[category] = {}
-                #for k, v in items.items():
-                #    if k in self.data[category]:
-                #        print(f"WARN  Overriding localised string '{category}-{k}'")
-                self.data[category].update(items)
 
-        print("\nINFO  Sucessfully loaded locale data.")
+    # Changes whenever the strings of this locale (or of the fallback) change, see incremental.py
+    def fingerprint(self):
+        if self.dataHash is None:
+            dataHash = hashlib.sha256(marshal.dumps(self.data))
+            if self.fallback:
+                dataHash.update(self.fallback.fingerprint().encode('utf-8'))
+            self.dataHash = dataHash.hexdigest()
+        return self.dataHash
 
 
     def resolve(self, resource, warn=True):
-        result = self.__resolve(resource, warn)
+        if not isinstance(resource, list):
+            return resource
+
+        # The same localised strings are resolved over and over (e.g. all the barrel recipes)
+        key = hashableResource(resource)
+        if key in self.resolved:
+            result = self.resolved[key]
+        else:
+            result = self.__resolve(resource, warn)
+            self.resolved[key] = result
+
         if result is None:
             if warn:
                 print(f"\nWARN: Failed to localize: {resource}")
@@ -31,9 +61,6 @@ class Localisation:
             return result
 
     def __resolve(self, resource, warn=True):
-        if not isinstance(resource, list):
-            return resource
-        
         splits = resource[0].split('.', 1)
 
         if len(splits) == 1:
@@ -42,10 +69,7 @@ class Localisation:
             if resource[0] == "":
                 # Quote: 
                 # The special locale key: "" is used to concatenate, [...]
-                result = ""
-                for paritalResource in resource:
-                    result += self.resolve(paritalResource, warn)
-                return result
+                return "".join(self.resolve(paritalResource, warn) for paritalResource in resource)
             else:
                 # You can have basic stuff like '10' or 'and' in parts of a localized string
                 return resource[0]
@@ -53,82 +77,234 @@ class Localisation:
         assert(len(splits) == 2)   
 
         # Do the localized string lookup
-        if splits[0] in self.data and splits[1] in self.data[splits[0]]:
-            result = self.data[splits[0]][splits[1]]
-        else:
+        template = self.template(splits[0], splits[1])
+        if template is None:
             return None
 
-        if len(resource) > 1:
-            # @Incomplete: There are some weird hardcoded replacement patters.
-            newResult = ""
-            parts = re.split(r'(__\d__)', result)
-            for part in parts:
-                if re.match(r'(__\d__)', part):
-                    arg = int(part[2:-2])
-                    assert(len(resource) > arg)
-                    newResult += self.resolve(resource[arg])
+        result = []
+        for part in template:
+            if isinstance(part, str):
+                result.append(part)
+            elif isinstance(part, int):
+                if len(resource) > part:
+                    result.append(self.resolve(resource[part]))
                 else:
-                    newResult += part
+                    result.append(f'__{part}__')
+            else:
+                # Reference to the name of another prototype, e.g. ('entity-name', 'boiler')
+                (category, name) = part
+                resolved = self.__resolve([f'{category}.{name}'])
+                result.append(resolved if resolved is not None else name)
+
+        return "".join(result)
 
-            return newResult
+    # Returns the compiled template of a localised string, or None if there is no such string.
+    def template(self, category, key):
+        if (category, key) in self.templates:
+            return self.templates[(category, key)]
+
+        if category in self.data and key in self.data[category]:
+            template = compileTemplate(self.data[category][key])
+        elif self.fallback:
+            template = self.fallback.template(category, key)
         else:
-            return result
- 
-    def crawlLocalisation(self, dirs):
-        result = {}
- 
-        # first crawl core and the base mod
-        core = dirs['game'] / 'data' / 'core'
-        base = dirs['game'] / 'data' / 'base'
-        result['core'] = self.parseLocaleDataForSingleMod(core)
-        result['base'] = self.parseLocaleDataForSingleMod(base)
-
-        # Now third-party mods
-        for modDir in dirs['mods'].iterdir():
-            if modDir.is_dir() or modDir.suffix == '.zip':    # @Incomplete: zip
-                modName = modDir.stem
-                result[modName] = self.parseLocaleDataForSingleMod(modDir)
-        
-        return result
-
-    def parseLocaleDataForSingleMod(self, modDir):
-        result = {}
-
-        if zipfile.is_zipfile(modDir):
-            with zipfile.ZipFile(modDir, 'r') as modZip:
-                files = modZip.namelist()
-                zipInternalPath = f'{modDir.stem}/locale/{self.locale}'
-                files = filter(lambda f: f.startswith(zipInternalPath) and f.endswith('.cfg'), files)
+            template = None
+        self.templates[(category, key)] = template
+        return template
+
+
+# Resolves the localised strings of the prototypes in several locales at once.
+#
+# The prototypes themselves get the strings of the first (primary) locale, the strings of all
+# locales are collected in one table per locale: {section: {name: {field: string}}}.
+# Only the primary locale warns about strings that can't be resolved.
+class LocaleTables:
+    def __init__(self, localisations, collect=True):
+        self.localisations = localisations     # locale -> Localisation, in the given order
+        self.primaryLocale = next(iter(localisations))
+        self.primary = localisations[self.primaryLocale]
+        self.tables = {locale: {} for locale in localisations} if collect else None
+
+
+    # Resolves obj[field] in place, section is the key of the table, e.g. 'items'.
+    # Returns the strings as {locale: string}, passing them as resolved (e.g. from a previous run,
+    # see incremental.py) skips resolving them again.
+    def localise(self, obj, field, section, warn=True, resolved=None):
+        if resolved is None:
+            resource = obj[field]
+            resolved = {}
+            for locale, loc in self.localisations.items():
+                if loc is self.primary:
+                    resolved[locale] = loc.resolve(resource, warn)
+                elif self.tables is not None:
+                    resolved[locale] = loc.resolve(resource, warn=False)
+        obj[field] = resolved[self.primaryLocale]
+
+        if self.tables is None:
+            return resolved
+        for locale, result in resolved.items():
+            sectionTable = self.tables[locale].setdefault(section, {})
+            sectionTable.setdefault(obj['name'], {})[field] = result
+        return resolved
+
+
+    # Writes locale-<locale>.json for every locale, returns the file names.
+    def write(self, outputDir):
+        fileNames = []
+        for locale, table in (self.tables or {}).items():
+            fileName = f'locale-{locale}.json'
+            with open(outputDir / fileName, 'w', encoding='utf-8') as f:
+                json.dump(table, f, ensure_ascii=False)
+            fileNames.append(fileName)
+        return fileNames
+
+
+# Returns {locale: Localisation} for all given locales, crawling all of them in one pass over the mods.
+# Like in Factorio, English is the fallback for strings that are not translated.
+def loadLocalisations(fs, locales, cache=None):
+    allLocales = locales if 'en' in locales else locales + ['en']
+    data = loadLocaleData(fs, allLocales, cache)
+
+    english = Localisation(fs, 'en', data=data['en'])
+    result = {}
+    for locale in locales:
+        result[locale] = english if locale == 'en' else Localisation(fs, locale, data=data[locale], fallback=english)
+    return result
+
+
+# Returns {locale: {category: {key: string}}} with the strings of all mods merged (in load order).
+def loadLocaleData(fs, locales, cache=None):
+    fileNames = findLocaleFiles(fs, locales)
+
+    result = {}
+    fingerprints = {}   # locale -> {modName: fingerprint}
+    pending = []        # locales that have to be merged (again)
+    for locale in locales:
+        if cache:
+            fingerprints[locale] = {modName: cache.fingerprint(fs, modName, files[locale]) for modName, files in fileNames.items()}
+            merged = cache.loadMerged(locale, cache.mergedFingerprint(fingerprints[locale].values()))
+            if merged is not None:
+                result[locale] = merged
+                continue
+        pending.append(locale)
+
+    dataPerMod = crawlLocalisation(fs, fileNames, pending, cache, fingerprints)
+    for locale in pending:
+        merged = {}
+        for arr in dataPerMod[locale].values():
+            for category, items in arr.items():
+                if not category in merged:
+                    merged[category] = {}
+                #for k, v in items.items():
+                #    if k in merged[category]:
+                #        print(f"WARN  Overriding localised string '{category}-{k}'")
+                merged[category].update(items)
+
+        if cache:
+            cache.storeMerged(locale, cache.mergedFingerprint(fingerprints[locale].values()), merged)
+        result[locale] = merged
+
+    print("\nINFO  Sucessfully loaded locale data.")
+    return result
+
+
+# Returns {modName: {locale: [locale files]}}, first core and the base mod, then third-party mods
+def findLocaleFiles(fs, locales):
+    result = {}
+    for modName in ['core', 'base'] + fs.modNames():
+        if not modName in result:
+            result[modName] = {locale: fs.listFiles(modName, f'locale/{locale}', '.cfg') for locale in locales}
+    return result
+
+
+# Returns {locale: {modName: {category: {key: string}}}}.
+#
+# The mods are read and parsed concurrently (it is mostly waiting for the disk and decompressing,
+# which releases the GIL), every thread reads all locales of one mod, so each mod archive is only
+# opened once. The result keeps the order of fileNames, i.e. the override order when merging.
+def crawlLocalisation(fs, fileNames, locales, cache=None, fingerprints=None):
+    result = {locale: {} for locale in locales}
+
+    # The cache is only used from this thread (sqlite connections can't be shared).
+    toParse = {}    # modName -> locales that have to be parsed
+    for modName in fileNames:
+        for locale in locales:
+            if cache:
+                result[locale][modName] = cache.loadMod(locale, modName, fingerprints[locale][modName])
+                if result[locale][modName] is not None:
+                    continue
+            result[locale][modName] = None
+            toParse.setdefault(modName, []).append(locale)
+
+    def parseMod(modName):
+        return {locale: parseLocaleDataForSingleMod(fs, modName, fileNames[modName][locale]) for locale in toParse[modName]}
+
+    with ThreadPoolExecutor(max_workers=LOCALE_THREADS) as executor:
+        for modName, parsed in zip(toParse, executor.map(parseMod, toParse)):
+            for locale, data in parsed.items():
+                result[locale][modName] = data
+                if cache:
+                    cache.storeMod(locale, modName, fingerprints[locale][modName], data)
+    
+    return result
+
+
+def parseLocaleDataForSingleMod(fs, modName, fileNames):
+    result = {}
+
+    for fileName in fileNames:
+        inputData = fs.read(modName, fileName).decode('utf-8-sig').splitlines()
+        parseSingleFile(inputData, f'{modName}/{fileName}', result)
     
-                for fileName in files:
-                    with modZip.open(fileName, 'r') as cfgFile:
-                        inputData = cfgFile.read().decode('utf-8').splitlines()
-                        self.parseSingleFile(inputData, fileName, result)
-        
+    return result
+
+
+def parseSingleFile(inputData, fileName, outputDict):
+    currentCategory = EMPTY_CATEGORY
+    strings = None
+
+    for line in inputData:
+        if not line or line[0] == ';' or line[0] == '#' or line.isspace():
+            continue
+        elif line[0] == '[':
+            currentCategory = line[1:line.find(']')] if ']' in line else line[1:]
+            strings = outputDict.setdefault(currentCategory, {})
         else:
-            for localeFile in (modDir / 'locale' / self.locale).glob('*.cfg'):
-                with open(localeFile) as f:
-                    inputData = f.read().splitlines()
-                    self.parseSingleFile(inputData, localeFile, result)
-        
-        return result
-
-            
-    def parseSingleFile(self, inputData, fileName, outputDict):
-        currentCategory = self.EMPTY_CATEGORY
-
-        for line in inputData:
-            if line.startswith('['):
-                currentCategory = line[1:-1]
-                if not currentCategory in outputDict:
-                    outputDict[currentCategory] = {}
-            elif line == '' or line.isspace() or line.startswith(';'):
+            # Only the first '=' separates the key, the value can contain more of them
+            (key, separator, value) = line.partition('=')
+            if not separator:
                 continue
-            else:
-                splits = line.split('=')    # @Robustness
-                if currentCategory == self.EMPTY_CATEGORY and not self.EMPTY_CATEGORY in outputDict:
-                    outputDict[self.EMPTY_CATEGORY] = {}
-                outputDict[currentCategory][splits[0]] = splits[1]
+            if strings is None:
+                strings = outputDict.setdefault(EMPTY_CATEGORY, {})
+            strings[key] = value
+
+    if EMPTY_CATEGORY in outputDict:
+        print(f'WARN  Localised strings without category ({fileName})')
+
+
+# Splits a localised string into a list of parts:
+#   - str: literal text
+#   - int: parameter (__1__ -> 1)
+#   - (category, name): name of another prototype (__ITEM__coal__ -> ('item-name', 'coal'))
+def compileTemplate(string):
+    parts = []
+    position = 0
+    for match in TEMPLATE_PLACEHOLDER.finditer(string):
+        if match.start() > position:
+            parts.append(string[position:match.start()])
+        if match.group(1):
+            parts.append(int(match.group(1)))
+        else:
+            parts.append((TEMPLATE_REFERENCES[match.group(2)], match.group(3)))
+        position = match.end()
+
+    if position < len(string):
+        parts.append(string[position:])
+    return parts
+
 
-        if self.EMPTY_CATEGORY in outputDict:
-            print(f'WARN  Localised strings without category ({fileName})')
+# Localised strings are (nested) lists, this turns them into (nested) tuples so they can be dict keys
+def hashableResource(resource):
+    if isinstance(resource, list):
+        return tuple(hashableResource(part) for part in resource)
+    return resource
@@ -1,10 +1,13 @@
 import argparse
-import json
 import sys
 from pathlib import Path
 
+import batch
 import factorioPaths
+import pipeline
 import processing
+import watch
+from errors import ScraperError
 
 
 def parseArgs():
@@ -12,70 +15,80 @@ def parseArgs():
     parser.add_argument('outputDir', help='Output directory for the icons and JSON file')
     parser.add_argument("-g", "--game", help='path of your factorio install (Optional: If not given tries to find Factorio at some default locations)')
     parser.add_argument("-m", "--mods", help='path of your mods directory (Optional: If not given tries to find /mods at some default locations)')
+    parser.add_argument("-j", "--jobs", type=int, help='number of processes used to render the icons, or to process the profiles with --batch (Optional: Defaults to the number of CPUs)')
+    parser.add_argument("--log", help='factorio-current.log with the exported data.raw (Optional: Defaults to the one in the game folder)')
+    parser.add_argument("--script-output", help='folder with the exported script output (Optional: Defaults to script-output in the game or mods folder)')
+    parser.add_argument("--atlas", action='store_true', help='pack all icons into a few atlas sheets instead of writing one file per icon')
+    parser.add_argument("--layer-cache", type=int, default=128, metavar='MB', help='memory per process for caching decoded icon layers, 0 disables it (Optional: Defaults to 128)')
+    parser.add_argument("--cache-tinted-layers", action='store_true', help='also keep the tinted variants of the icon layers in the layer cache')
+    parser.add_argument("--data-raw", choices=['lazy', 'full'], help='how data.raw is decoded: all at once (fastest) or only the accessed types (least memory, keeps data.raw indexed in --watch mode) (Optional: Defaults to full, or lazy with --watch)')
+    parser.add_argument("--stages", help='comma separated stages to run: data, locale, icons, groups (plus the ones they depend on), e.g. data for a quick look at the numbers (Optional: Defaults to all)')
+    parser.add_argument("--locales", help='comma separated locales, e.g. en,de,fr: writes locale-<locale>.json for each of them, output.json uses the first one (Optional: Defaults to en only)')
+    parser.add_argument("--split", action='store_true', help='write one file per section (items.json, recipes.json, ...) and manifest.json instead of output.json')
+    parser.add_argument("--shard-by-group", action='store_true', help='like --split, but items, fluids and recipes are split further into one file per item group')
+    parser.add_argument("--sqlite", nargs='?', const='', metavar='FILE', help='also write the data into a SQLite database (Optional: Defaults to <outputDir>/output.sqlite)')
+    parser.add_argument("--compress", help='comma separated compressed copies of output.json to write: gz, br (Optional: br needs brotli installed)')
+    parser.add_argument("--incremental", action='store_true', help='only render the icons of prototypes that changed since the previous run and delete icons that are not used anymore')
+    parser.add_argument("--batch", metavar='PROFILES', help='JSON file with a list of mod profiles ({"name", "mods", "log", "scriptOutput"}) to process against the same game, each is written to <outputDir>/<name> (see batch.py)')
+    parser.add_argument("--watch", nargs='?', type=float, const=2.0, metavar='SECONDS', help='keep running and process the data again whenever the log, the script output or the mods change (Optional: polls every 2 seconds)')
+    parser.add_argument("--cache", help='directory for cached data of previous runs, shared by all output folders (Optional: Defaults to factorio-data-scraper in the cache folder of the user, e.g. ~/.cache)')
+    parser.add_argument("--no-cache", action='store_true', help='do not read or write any cached data')
 
     args = parser.parse_args()
-    dirs = factorioPaths.getPaths(args)
+    dirs = factorioPaths.getPaths(args, needsMods=not args.batch)
+    dirs['log'] = Path(args.log).resolve() if args.log else None
+    dirs['scriptOutput'] = Path(args.script_output).resolve() if args.script_output else None
 
     dirs['output'] = Path(args.outputDir) if args.outputDir else Path.cwd()
     dirs['icons'] = dirs['output'] / 'icons'
 
-    if not Path(dirs['output']).is_dir():
-        sys.exit(f"ERROR  The given output path is not a directory!")
-
-    dirs['icons'].mkdir(exist_ok=True)
-    return dirs
-
-
-def loadData(dirs):
-    dataRaw = parseDataRaw(dirs)
-    
-    scriptOutput = dirs['game'] / "script-output"
-    if not scriptOutput.is_dir():
-        scriptOutput = dirs['mods'] / "script-output"
-        if not scriptOutput.is_dir():
-            sys.exit(f"ERROR Unable to find script-output. You have to run Factorio and create a new game (or load a save).")
-    
-    try:
-        with open(scriptOutput / "recipes.json", 'r') as f:
-            recipes = json.load(f)
-        with open(scriptOutput / "items.json", 'r') as f:
-            items = json.load(f)
-        with open(scriptOutput / "fluids.json", 'r') as f:
-            fluids = json.load(f)
-        with open(scriptOutput / "entities.json", 'r') as f:
-            entites = json.load(f)
-    except:
-        sys.exit(f"ERROR  Unable to open the script output. You have to run Factorio and create a new game (or load a save).")
-
-    return {"raw": dataRaw, "recipes": recipes, "items": items, "fluids": fluids, "entities": entites}
+    if args.sqlite is None:
+        dirs['sqlite'] = None
+    else:
+        dirs['sqlite'] = Path(args.sqlite).resolve() if args.sqlite else dirs['output'] / 'output.sqlite'
 
+    if args.no_cache:
+        dirs['cache'] = None
+    else:
+        dirs['cache'] = Path(args.cache).resolve() if args.cache else factorioPaths.defaultCacheDir()
 
-def parseDataRaw(dirs):
-    MARKER_START = "---- data export start ----"
-    MARKER_END   = "---- data export end   ----"
-
-    logFile = dirs['game'] / "factorio-current.log"
-    if not logFile.is_file():
-        sys.exit(f"ERROR  Unable to find factorio-current.log in: {dirs['game']}")
-
-    # Slightly dumb code: parses the data between MARKER_START and MARKER_END as JSON.
-    jsonData = ""
-    with open(logFile, 'r') as f:
-        foundStart = False
-        for line in f:
-            if MARKER_START in line:
-                foundStart = True
-            elif MARKER_END in line:
-                break
-            elif foundStart:
-                jsonData += line
-
-    if not jsonData:
-        sys.exit(f"ERROR  Unable to parse factorio-current.log in: {dirs['game']}")
-    return json.loads(jsonData)
+    if not Path(dirs['output']).is_dir():
+        raise ScraperError(f"The given output path is not a directory!")
+
+    if args.batch and args.watch is not None:
+        raise ScraperError(f"--batch can't be combined with --watch")
+    if args.batch and (args.log or args.script_output):
+        raise ScraperError(f"With --batch the log and script output are set per profile")
+
+    # Watch mode keeps the lazily indexed data.raw between the runs
+    dataRaw = args.data_raw or ('lazy' if args.watch is not None else 'full')
+    compressions = [c.strip() for c in args.compress.split(',') if c.strip()] if args.compress else []
+    options = {
+        'jobs': args.jobs, 'atlas': args.atlas,
+        'layerCacheMB': args.layer_cache, 'cacheTintedLayers': args.cache_tinted_layers,
+        'dataRaw': dataRaw, 'incremental': args.incremental, 'watch': args.watch,
+        'compress': compressions, 'split': args.split, 'shardByGroup': args.shard_by_group,
+        'locales': [l.strip() for l in args.locales.split(',') if l.strip()] if args.locales else None,
+        'batch': args.batch, 'quiet': False,
+        'stages': processing.resolveStages([s.strip() for s in args.stages.split(',') if s.strip()]) if args.stages else processing.STAGES,
+    }
+    pipeline.checkOptions(options)
+
+    # In batch mode every profile gets its own folder
+    if not args.batch:
+        dirs['icons'].mkdir(exist_ok=True)
+    return dirs, options
 
 
 if __name__ == "__main__":
-    dirs = parseArgs()
-    data = loadData(dirs)
-    processing.process(data, dirs)
\ No newline at end of file
+    try:
+        dirs, options = parseArgs()
+        if options['batch']:
+            batch.runBatch(dirs, options, batch.loadProfiles(options['batch']))
+        elif options['watch'] is not None:
+            watch.watch(dirs, options, options['watch'])
+        else:
+            data = pipeline.loadData(dirs, options)
+            processing.process(data, dirs, options)
+    except ScraperError as e:
+        sys.exit(f"ERROR  {e}")
\ No newline at end of file
@@ -0,0 +1,284 @@
+import json
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+
+# Read access to the files of core, base and all mods, no matter if a mod is a folder or a zip.
+#
+# This is built once per run: The mods are mapped to their folder or archive up front (only the
+# mods that are enabled, in their newest version, see findModCandidates), so looking
+# up a file is a dict access instead of globbing the mods folder. Zips stay open in a small pool
+# (least recently used ones are closed) together with an index of their members, so the central
+# directory of an archive is only parsed once and not for every single file.
+#
+# Paths are relative to the root of the mod, e.g. read('base', 'graphics/icons/coal.png').
+
+class ModFileSystem:
+    def __init__(self, dirs, maxOpenZips=16):
+        self.maxOpenZips = maxOpenZips
+        self.mods = OrderedDict()   # name -> folder or zip, in load order
+        self.versions = {}          # name -> version string
+
+        candidates = findModCandidates(dirs)
+        for (name, (modPath, info)) in sortByLoadOrder(candidates):
+            self.mods[name] = modPath
+            self.versions[name] = info.get('version', '')
+
+        self.initPool()
+
+
+    # The pool can't be sent to other processes, they get their own (empty) one.
+    def __getstate__(self):
+        return {'maxOpenZips': self.maxOpenZips, 'mods': self.mods, 'versions': self.versions}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.initPool()
+
+    def initPool(self):
+        self.zipPool = OrderedDict()    # zip path -> PooledZip
+        self.lock = threading.Lock()
+
+
+    def modNames(self):
+        return list(self.mods.keys())
+
+    def hasMod(self, mod):
+        return mod in self.mods
+
+    def isZipped(self, mod):
+        return self.mods[mod].suffix == '.zip'
+
+
+    # Splits '__mod__/some/file.png' into ('mod', 'some/file.png')
+    def splitPath(self, path):
+        parts = re.split(r'__(.*)__/', path)[1:]
+        assert(len(parts) == 2)
+        return (parts[0], parts[1])
+
+
+    # Returns the path of the file on disk for mods that are folders, None for zipped mods.
+    def filePath(self, mod, relativePath):
+        modPath = self.modPath(mod)
+        if self.isZipped(mod):
+            return None
+        return modPath / relativePath
+
+
+    def read(self, mod, relativePath):
+        modPath = self.modPath(mod)
+        if not self.isZipped(mod):
+            with open(modPath / relativePath, 'rb') as f:
+                return f.read()
+
+        pooled = self.acquireZip(modPath)
+        try:
+            return pooled.zip.read(pooled.member(relativePath, mod))
+        finally:
+            self.releaseZip(pooled)
+
+
+    # Something that changes whenever the file changes, without reading the file itself.
+    # Members of zips are identified by their CRC instead of the path of the zip, so the same mod
+    # in several mods folders (see batch.py) shares the cached icons.
+    def identity(self, mod, relativePath):
+        modPath = self.modPath(mod)
+        if not self.isZipped(mod):
+            stat = (modPath / relativePath).stat()
+            return [str(modPath / relativePath), stat.st_mtime_ns, stat.st_size]
+
+        pooled = self.acquireZip(modPath)
+        try:
+            info = pooled.zip.getinfo(pooled.member(relativePath, mod))
+            return [mod, info.filename, info.CRC, info.file_size]
+        finally:
+            self.releaseZip(pooled)
+
+
+    # Relative paths of all files directly in 'directory' ending with 'suffix'
+    def listFiles(self, mod, directory, suffix):
+        modPath = self.modPath(mod)
+        if not self.isZipped(mod):
+            return sorted(str(p.relative_to(modPath).as_posix()) for p in (modPath / directory).glob('*' + suffix))
+
+        prefix = directory.rstrip('/') + '/'
+        pooled = self.acquireZip(modPath)
+        try:
+            return sorted(p for p in pooled.members
+                    if p.startswith(prefix) and p.endswith(suffix) and not '/' in p[len(prefix):])
+        finally:
+            self.releaseZip(pooled)
+
+
+    def modPath(self, mod):
+        if not mod in self.mods:
+            raise FileNotFoundError(f"Mod '{mod}' is not installed")
+        return self.mods[mod]
+
+
+    def acquireZip(self, zipPath):
+        with self.lock:
+            if zipPath in self.zipPool:
+                pooled = self.zipPool[zipPath]
+                self.zipPool.move_to_end(zipPath)
+            else:
+                pooled = PooledZip(zipPath)
+                self.zipPool[zipPath] = pooled
+            pooled.users += 1
+
+            # Close the least recently used zips, but never one that is currently read from.
+            if len(self.zipPool) > self.maxOpenZips:
+                for (path, candidate) in list(self.zipPool.items()):
+                    if len(self.zipPool) <= self.maxOpenZips:
+                        break
+                    if candidate.users == 0:
+                        candidate.zip.close()
+                        del self.zipPool[path]
+
+            return pooled
+
+    def releaseZip(self, pooled):
+        with self.lock:
+            pooled.users -= 1
+
+
+    def close(self):
+        with self.lock:
+            for pooled in self.zipPool.values():
+                pooled.zip.close()
+            self.zipPool.clear()
+
+
+## Mod index
+# Factorio only loads the enabled mods from mod-list.json (mods that are not listed are enabled 
+# by default), and from each of them only the newest version that is installed.
+
+# Returns {name: (path, info)} with the mod that Factorio would load for each name
+def findModCandidates(dirs):
+    disabled = set()
+    modListFile = dirs['mods'] / 'mod-list.json'
+    if modListFile.is_file():
+        with open(modListFile, 'r', encoding='utf-8') as f:
+            modList = json.load(f)
+        disabled = {mod['name'] for mod in modList.get('mods', []) if not mod.get('enabled', True)}
+
+    # Old versions and disabled mods are sorted out by their filename first, so only the info.json
+    # of the mods that are actually loaded have to be read.
+    newest = {}     # name -> (version, path)
+    unnamed = []    # paths that don't follow <name>_<version>, their name is in info.json
+    for modPath in dirs['mods'].iterdir():
+        if not (modPath.is_dir() or (modPath.suffix == '.zip' and zipfile.is_zipfile(modPath))):
+            continue
+
+        (name, version) = parseModFileName(modPath)
+        if version is None:
+            # Folders without info.json are not mods (e.g. script-output)
+            if modPath.suffix == '.zip' or (modPath / 'info.json').is_file():
+                unnamed.append(modPath)
+        elif not name in disabled:
+            if not name in newest or parseVersion(version) > parseVersion(newest[name][0]):
+                newest[name] = (version, modPath)
+
+    candidates = {}
+    for (name, (version, modPath)) in newest.items():
+        candidates[name] = (modPath, readModInfo(modPath, name, version))
+
+    for modPath in unnamed:
+        info = readModInfo(modPath, modPath.name, '')
+        name = info['name']
+        if name in disabled:
+            continue
+        if not name in candidates or parseVersion(info['version']) > parseVersion(candidates[name][1]['version']):
+            candidates[name] = (modPath, info)
+
+    candidates['core'] = (dirs['game'] / 'data' / 'core', readModInfo(dirs['game'] / 'data' / 'core', 'core', ''))
+    candidates['base'] = (dirs['game'] / 'data' / 'base', readModInfo(dirs['game'] / 'data' / 'base', 'base', ''))
+    return candidates
+
+
+# Returns (name, version) of <name>_<version>, or (name, None) for other names.
+def parseModFileName(modPath):
+    stem = modPath.stem if modPath.suffix == '.zip' else modPath.name
+    match = re.match(r'^(.+)_(\d+\.\d+\.\d+)$', stem)
+    if match:
+        return (match.group(1), match.group(2))
+    return (stem, None)
+
+
+def parseVersion(version):
+    return tuple(int(x) for x in re.findall(r'\d+', version))
+
+
+# Reads info.json of a mod (folder or zip). Falls back to the given name/version if that fails.
+def readModInfo(modPath, name, version):
+    try:
+        if modPath.is_dir():
+            with open(modPath / 'info.json', 'r', encoding='utf-8-sig') as f:
+                info = json.load(f)
+        else:
+            with zipfile.ZipFile(modPath, 'r') as modZip:
+                infoFiles = [n for n in modZip.namelist() if n.count('/') == 1 and n.endswith('/info.json')]
+                info = json.loads(modZip.read(infoFiles[0]).decode('utf-8-sig'))
+    except (OSError, IndexError, ValueError, zipfile.BadZipFile):
+        print(f"WARN  Unable to read info.json of {modPath}")
+        info = {}
+
+    info.setdefault('name', name)
+    info.setdefault('version', version)
+    # Like Factorio: Mods without dependencies depend on base (core and base themselves don't)
+    info.setdefault('dependencies', [] if info['name'] in ['core', 'base'] else ['base'])
+    return info
+
+
+# Factorio loads the mods in dependency order, ties are broken by the (natural sort order) name.
+# Returns the items of 'candidates' in that order.
+def sortByLoadOrder(candidates):
+    def naturalKey(name):
+        return [int(x) if x.isdigit() else x for x in re.split(r'(\d+)', name.lower())]
+
+    dependencies = {}
+    for (name, (modPath, info)) in candidates.items():
+        dependencies[name] = set()
+        for dependency in info['dependencies']:
+            # '! mod' is an incompatibility and '~ mod' does not affect the load order
+            match = re.match(r'^\s*(\(\?\)|\?|!|~)?\s*([^<>=\s]+)', dependency)
+            if match and match.group(1) not in ['!', '~'] and match.group(2) in candidates:
+                dependencies[name].add(match.group(2))
+    if 'core' in candidates:
+        dependencies['base'].add('core')
+
+    result = []
+    loaded = set()
+    remaining = sorted(candidates.keys(), key=naturalKey)
+    while remaining:
+        ready = [name for name in remaining if dependencies[name] <= loaded]
+        if not ready:
+            # Circular dependency, Factorio would refuse to start. Just take what is left.
+            print(f"WARN  Circular mod dependencies between: {', '.join(remaining)}")
+            ready = remaining
+        name = ready[0]
+        result.append((name, candidates[name]))
+        loaded.add(name)
+        remaining.remove(name)
+
+    return result
+
+
+class PooledZip:
+    def __init__(self, zipPath):
+        self.zip = zipfile.ZipFile(zipPath, 'r')
+        self.users = 0
+
+        # Mod zips contain a single top level folder (which does not have to match the zip name).
+        # Map the paths relative to that folder to the real member names.
+        self.members = {}
+        for name in self.zip.namelist():
+            parts = name.split('/', 1)
+            if len(parts) == 2 and parts[1] and not name.endswith('/'):
+                self.members[parts[1]] = name
+
+    def member(self, relativePath, mod):
+        if not relativePath in self.members:
+            raise FileNotFoundError(f"'{relativePath}' not found in mod '{mod}' ({self.zip.filename})")
+        return self.members[relativePath]
@@ -0,0 +1,261 @@
+import gzip
+import hashlib
+import json
+import os
+
+from errors import ScraperError
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Writes the processed data one section at a time.
+#
+# Every section is encoded in chunks (with compact separators) and written as soon as it is done,
+# so the encoded file never has to be in memory as a whole. Optionally the same chunks are
+# compressed into <file>.gz and/or <file>.br in the same pass.
+#
+# OutputWriter writes all sections into output.json, SplitOutputWriter writes one file per
+# section (optionally one per item group) plus manifest.json with the content hash of every file,
+# so clients only fetch what they need and can cache every file on its own.
+#
+# Everything is written to temporary files first and moved into place by close(), so a web server
+# never serves a half written file. The files of SplitOutputWriter are all moved into place
+# together (the manifest last), so the manifest never lists hashes of other files than the ones
+# next to it.
+
+COMPRESSIONS = ['gz', 'br']
+
+# The small chunks of the encoder are collected up to this size before they are written
+BUFFER_SIZE = 1 << 16
+
+def checkAvailable(compressions):
+    if 'br' in compressions and brotli is None:
+        raise ScraperError("Brotli compression needs brotli, install it with: pip install brotli")
+
+
+# options: 'split', 'shardByGroup' and 'compress' (see main.parseArgs)
+def createOutputWriter(outputDir, options):
+    if options['split'] or options['shardByGroup']:
+        return SplitOutputWriter(outputDir, options['compress'], options['shardByGroup'])
+    return OutputWriter(outputDir / 'output.json', options['compress'])
+
+
+class OutputWriter:
+    def __init__(self, outFile, compressions=[]):
+        self.outFile = outFile
+        self.file = StreamedFile(outFile, compressions)
+        self.written = []       # keys of the sections that were written
+        self.file.write('{')
+
+
+    def writeSection(self, key, value):
+        if key in self.written:
+            return
+
+        self.file.write((',' if self.written else '') + json.dumps(key) + ':')
+        self.file.writeValue(value)
+        self.written.append(key)
+
+
+    # Writes all sections of data which were not written yet (except 'raw') and moves the files
+    # into place. Returns the paths of all written files.
+    def close(self, data):
+        for key in list(data.keys()):
+            if key != 'raw':
+                self.writeSection(key, data[key])
+        self.file.write('}')
+        return self.file.close()
+
+    # Removes the temporary files, e.g. if processing failed.
+    def abort(self):
+        self.file.abort()
+
+
+class SplitOutputWriter:
+    # Sections whose entries are sharded by their item group
+    SHARDED_SECTIONS = ['items', 'fluids', 'recipes']
+
+    def __init__(self, outputDir, compressions=[], shardByGroup=False):
+        self.outputDir = outputDir
+        self.outFile = outputDir / 'manifest.json'
+        self.compressions = compressions
+        self.shardByGroup = shardByGroup
+        self.manifest = {}      # section -> {'file', 'hash'} or {group: {'file', 'hash'}} if sharded
+        self.pending = []       # StreamedFiles that are complete, but not moved into place yet
+
+
+    def writeSection(self, key, value):
+        if key in self.manifest:
+            return
+
+        if self.shardByGroup and key in self.SHARDED_SECTIONS:
+            shards = {}
+            for (name, entry) in value.items():
+                shards.setdefault(entry['group'], {})[name] = entry
+
+            self.manifest[key] = {}
+            for (group, shard) in shards.items():
+                self.manifest[key][group] = self.writeFile(f'{key}-{group}.json', shard)
+        else:
+            self.manifest[key] = self.writeFile(f'{key}.json', value)
+
+
+    def writeFile(self, fileName, value):
+        f = StreamedFile(self.outputDir / fileName, self.compressions)
+        self.pending.append(f)
+        f.writeValue(value)
+        f.finish()
+        return {'file': fileName, 'hash': f.hexdigest()}
+
+
+    # Writes all sections which were not written yet and the manifest, moves all files into place
+    # and deletes the files of the previous manifest that are not used anymore (e.g. the shards of
+    # removed item groups). Returns the paths of all written files.
+    def close(self, data):
+        for key in list(data.keys()):
+            if key != 'raw':
+                self.writeSection(key, data[key])
+
+        f = StreamedFile(self.outFile)
+        self.pending.append(f)
+        f.writeValue(self.manifest)
+        f.finish()
+
+        previousPaths = self.manifestPaths(readManifest(self.outFile))
+        paths = []
+        for f in self.pending:
+            paths += f.commit()
+        self.pending = []
+
+        for path in previousPaths - set(paths):
+            if path.is_file():
+                path.unlink()
+        return paths
+
+    # Removes the temporary files, e.g. if processing failed. The previous output stays as it is.
+    def abort(self):
+        for f in self.pending:
+            f.abort()
+        self.pending = []
+
+
+    # All files of a manifest, with every compressed copy they could have
+    def manifestPaths(self, manifest):
+        fileNames = []
+        for entry in manifest.values():
+            if 'file' in entry:
+                fileNames.append(entry['file'])
+            else:
+                fileNames += [shard['file'] for shard in entry.values()]
+
+        paths = set()
+        for fileName in fileNames:
+            if '/' in fileName or '\\' in fileName:
+                continue    # never delete anything outside of the output folder
+            paths.add(self.outputDir / fileName)
+            paths.update(self.outputDir / f"{fileName}.{compression}" for compression in COMPRESSIONS)
+        return paths
+
+
+# Returns the manifest of a previous run, or {} if there is none (or it can't be read).
+def readManifest(manifestFile):
+    try:
+        with open(manifestFile, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict) or not all(isinstance(entry, dict) for entry in manifest.values()):
+        return {}
+    return manifest
+
+
+# A file that is written in chunks (plus its compressed copies) and moved into place on close().
+class StreamedFile:
+    def __init__(self, path, compressions=[]):
+        self.encoder = json.JSONEncoder(separators=(',', ':'))
+        self.hash = hashlib.sha256()
+        self.buffer = []
+        self.bufferSize = 0
+
+        self.files = {}         # final path -> temporary file
+        self.outFile = self.open(path)
+        self.gzipFile = None
+        self.gzipRawFile = None
+        self.brotliFile = None
+        if 'gz' in compressions:
+            self.gzipRawFile = self.open(path.with_name(path.name + '.gz'))
+            self.gzipFile = gzip.GzipFile(filename=path.name, mode='wb', fileobj=self.gzipRawFile, compresslevel=9, mtime=0)
+        if 'br' in compressions:
+            self.brotliFile = self.open(path.with_name(path.name + '.br'))
+            self.brotliCompressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=11)
+
+
+    def open(self, path):
+        tmpFile = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        self.files[path] = tmpFile
+        return open(tmpFile, 'wb')
+
+
+    def writeValue(self, value):
+        for chunk in self.encoder.iterencode(value):
+            self.write(chunk)
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.bufferSize += len(text)
+        if self.bufferSize >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        encoded = ''.join(self.buffer).encode('utf-8')
+        self.buffer = []
+        self.bufferSize = 0
+
+        self.hash.update(encoded)
+        self.outFile.write(encoded)
+        if self.gzipFile:
+            self.gzipFile.write(encoded)
+        if self.brotliFile:
+            self.brotliFile.write(self.brotliCompressor.process(encoded))
+
+
+    # Hash of the (uncompressed) content, for cache busting
+    def hexdigest(self):
+        return self.hash.hexdigest()[0:16]
+
+
+    # Moves the files into place, returns their paths.
+    def close(self):
+        self.finish()
+        return self.commit()
+
+
+    # Writes everything that is left to the temporary files, see commit()
+    def finish(self):
+        self.flush()
+
+        self.outFile.close()
+        if self.gzipFile:
+            self.gzipFile.close()
+            self.gzipRawFile.close()
+        if self.brotliFile:
+            self.brotliFile.write(self.brotliCompressor.finish())
+            self.brotliFile.close()
+
+    # Moves the finished temporary files into place, returns their paths.
+    def commit(self):
+        for (path, tmpFile) in self.files.items():
+            os.replace(tmpFile, path)
+        return list(self.files.keys())
+
+
+    # Removes the temporary files, e.g. if processing failed.
+    def abort(self):
+        for f in [self.outFile, self.gzipRawFile, self.brotliFile]:
+            if f:
+                f.close()
+        for tmpFile in self.files.values():
+            if tmpFile.exists():
+                tmpFile.unlink()
@@ -0,0 +1,188 @@
+import contextlib
+import io
+import json
+from pathlib import Path
+
+import dataraw
+import factorioPaths
+import outputwriter
+import processing
+from errors import ScraperError
+from localecache import MemoryLocaleCache, openLocaleCache
+
+# The post-processing as a library, for processing many mod sets in one process (e.g. a build
+# service) without paying the startup costs every time:
+#
+#     pipeline = Pipeline('/path/to/factorio', {'locales': ['en', 'de']}, cacheDir='/path/to/cache')
+#     data = pipeline.run('/path/to/modpack-a/mods', '/path/to/modpack-a/output')
+#     data = pipeline.run('/path/to/modpack-b/mods', '/path/to/modpack-b/output')
+#
+# run() writes the same files as main.py and returns the processed data (without 'raw'), the
+# counters of the icon renderer are in pipeline.stats afterwards. Errors are raised as ScraperError
+# (or whatever the cause was), nothing calls sys.exit.
+#
+# What stays warm between runs:
+#   - the parsed locale files of every mod (keyed by their fingerprint, so core and base are only
+#     parsed once), see MemoryLocaleCache
+#   - the decoded icon layers (keyed by their resolved path), if the icons are rendered in this
+#     process ('jobs': 1, the default here)
+#   - the on-disk caches in cacheDir (locale strings and rendered icons), shared by all mod sets
+#
+# With quiet=True all messages and progress bars are captured instead of printed, the text of the
+# last run is in pipeline.log.
+
+# Same keys as the options of main.parseArgs
+DEFAULT_OPTIONS = {
+    'jobs': 1, 'atlas': False,
+    'layerCacheMB': 128, 'cacheTintedLayers': False,
+    'dataRaw': 'full', 'incremental': False, 'watch': None,
+    'compress': [], 'split': False, 'shardByGroup': False,
+    'locales': None, 'batch': None, 'stages': processing.STAGES, 'quiet': False,
+}
+
+class Pipeline:
+    def __init__(self, gameDir, options={}, cacheDir=None, quiet=True):
+        self.gameDir = Path(gameDir).resolve()
+        if not factorioPaths.isPotentialGameDir(self.gameDir):
+            raise ScraperError(f"Invalid game path: {self.gameDir}")
+
+        unknown = set(options) - set(DEFAULT_OPTIONS)
+        if unknown:
+            raise ScraperError(f"Unknown option(s): {', '.join(sorted(unknown))}")
+        self.options = {**DEFAULT_OPTIONS, **options, 'quiet': quiet}
+        self.options['stages'] = processing.resolveStages(self.options['stages'])
+        checkOptions(self.options)
+
+        self.cacheDir = Path(cacheDir).resolve() if cacheDir else None
+        self.localeCache = MemoryLocaleCache()
+        self.layerCache = None      # see processing.prepare
+        self.stats = None
+        self.log = ''
+
+
+    # Processes the data exported for the mods in modsDir and writes the icons and output files to
+    # outputDir. The data is read from logFile and the scriptOutput folder, by default from
+    # factorio-current.log and the script output of the game dir (see loadData).
+    def run(self, modsDir, outputDir, logFile=None, scriptOutput=None, sqliteFile=None):
+        dirs = {
+            'game': self.gameDir,
+            'mods': Path(modsDir).resolve(),
+            'output': Path(outputDir).resolve(),
+            'cache': self.cacheDir,
+            'sqlite': Path(sqliteFile).resolve() if sqliteFile else None,
+            'log': Path(logFile).resolve() if logFile else None,
+            'scriptOutput': Path(scriptOutput).resolve() if scriptOutput else None,
+        }
+        dirs['icons'] = dirs['output'] / 'icons'
+        self.log = ''
+        if not factorioPaths.isPotentialModDir(dirs['mods']):
+            raise ScraperError(f"Invalid mod path: {dirs['mods']}")
+        if not dirs['output'].is_dir():
+            raise ScraperError(f"The given output path is not a directory: {dirs['output']}")
+        dirs['icons'].mkdir(exist_ok=True)
+
+        buffer = io.StringIO()
+        with contextlib.redirect_stdout(buffer) if self.options['quiet'] else contextlib.nullcontext():
+            try:
+                self.localeCache.backing = openLocaleCache(dirs['cache'])
+                context = processing.prepare(dirs, self.options, localeCache=self.localeCache, layerCache=self.layerCache)
+                self.layerCache = context['layerCache']
+                data = loadData(dirs, self.options)
+                dataRaw = data['raw']
+                try:
+                    self.stats = processing.process(data, dirs, self.options, context)
+                finally:
+                    if isinstance(dataRaw, dataraw.LazyDataRaw):
+                        dataRaw.close()
+                    if context['fs']:
+                        context['fs'].close()
+            finally:
+                self.localeCache.close()
+                self.log = buffer.getvalue()
+        return data
+
+
+    # Forgets the warm state, e.g. after mods were changed in place (same path, new content).
+    def reset(self):
+        self.localeCache = MemoryLocaleCache()
+        self.layerCache = None
+
+
+# Raises a ScraperError for invalid or unsupported combinations of options
+def checkOptions(options):
+    if options['incremental'] and not 'icons' in options['stages']:
+        raise ScraperError("--incremental needs the icons stage")
+    if options['atlas'] and not 'icons' in options['stages']:
+        raise ScraperError("--atlas needs the icons stage")
+    if options['incremental'] and options['atlas']:
+        raise ScraperError("--incremental can't be combined with --atlas")
+    if options['jobs'] is not None and options['jobs'] < 1:
+        raise ScraperError("--jobs has to be at least 1")
+    for compression in options['compress']:
+        if not compression in outputwriter.COMPRESSIONS:
+            raise ScraperError(f"Unknown compression '{compression}', use: {', '.join(outputwriter.COMPRESSIONS)}")
+    outputwriter.checkAvailable(options['compress'])
+
+
+# Reads data.raw from dirs['log'] and the script output from dirs['scriptOutput'].
+# If they are None the defaults are used: factorio-current.log of the game and script-output in
+# the game or mods folder.
+# dataRaw: data.raw of a previous run that is still up to date (see watch.py)
+def loadData(dirs, options, dataRaw=None):
+    if dataRaw is None:
+        dataRaw = parseDataRaw(dirs, options)
+
+    scriptOutput = scriptOutputDir(dirs)
+    if scriptOutput is None:
+        raise ScraperError(f"Unable to find script-output. You have to run Factorio and create a new game (or load a save).")
+
+    # The script output is only loaded once a processing stage needs it.
+    def scriptOutputLoader(fileName):
+        def load():
+            try:
+                with open(scriptOutput / fileName, 'r') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                raise ScraperError(f"Unable to open the script output. You have to run Factorio and create a new game (or load a save).") from e
+        return load
+
+    loaders = {}
+    for key in ["recipes", "items", "fluids", "entities"]:
+        if not (scriptOutput / f"{key}.json").is_file():
+            raise ScraperError(f"Unable to open the script output. You have to run Factorio and create a new game (or load a save).")
+        loaders[key] = scriptOutputLoader(f"{key}.json")
+
+    data = dataraw.LazyData(loaders)
+    data["raw"] = dataRaw
+    return data
+
+
+def parseDataRaw(dirs, options):
+    logFile = dataRawLog(dirs)
+    if not logFile.is_file():
+        raise ScraperError(f"Unable to find the log: {logFile}")
+
+    # Decodes the data between the export markers straight from the memory-mapped log.
+    if options['dataRaw'] == 'lazy':
+        dataRaw = dataraw.lazyDataRaw(logFile)
+    else:
+        dataRaw = dataraw.loadDataRaw(logFile)
+
+    if not dataRaw:
+        raise ScraperError(f"Unable to parse the log: {logFile}")
+    return dataRaw
+
+
+def dataRawLog(dirs):
+    return dirs['log'] or dirs['game'] / "factorio-current.log"
+
+# Returns the folder with the script output, or None if there is none
+def scriptOutputDir(dirs):
+    if dirs['scriptOutput']:
+        candidates = [dirs['scriptOutput']]
+    else:
+        candidates = [dirs['game'] / "script-output", dirs['mods'] / "script-output"]
+    for candidate in candidates:
+        if candidate.is_dir():
+            return candidate
+    return None
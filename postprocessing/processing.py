@@ -1,33 +1,146 @@
 import json 
 from pathlib import Path
 
-from localisation import Localisation
+from dataraw import LazyDataRaw
+from errors import ScraperError
+from indexes import buildIndexes
+from localecache import openLocaleCache
+from localisation import LocaleTables, loadLocalisations
+from outputwriter import createOutputWriter
 from progressbar import ProgressBar
+from sqliteexport import exportSqlite
+
+# The stages of the processing, in the order they run:
+#   'data':   normalizes and prunes the script output, builds the indexes
+#   'locale': localises the names and descriptions (otherwise they stay LocalisedStrings)
+#   'icons':  renders the icons (otherwise the prototypes have no 'icon')
+#   'groups': the item groups and subgroups
+# The mods (zips) are only opened for 'locale' and 'icons', PIL is only imported for 'icons'.
+STAGES = ['data', 'locale', 'icons', 'groups']
+STAGE_DEPENDENCIES = {'data': [], 'locale': ['data'], 'icons': ['data'], 'groups': ['data']}
+
+# Returns the given stages plus the ones they depend on, in the order they run.
+def resolveStages(stages):
+    selected = set()
+    def select(stage):
+        if not stage in STAGE_DEPENDENCIES:
+            raise ScraperError(f"Unknown stage '{stage}', use: {', '.join(STAGES)}")
+        if not stage in selected:
+            selected.add(stage)
+            for dependency in STAGE_DEPENDENCIES[stage]:
+                select(dependency)
+
+    for stage in stages:
+        select(stage)
+    return [stage for stage in STAGES if stage in selected]
+
+
+# Everything that only depends on the game and the mods: {'fs', 'localisations', 'pool', 'layerCache'}
+# This can be reused for several runs (see watch.py) as long as the mods don't change.
+# localeCache: Used instead of the locale cache in dirs['cache'] (see pipeline.py)
+# layerCache: The decoded icon layers of a previous run, used instead of a new cache (see pipeline.py)
+def prepare(dirs, options, localeCache=None, layerCache=None):
+    stages = options['stages']
+    fs = None
+    localisations = None
+    if 'locale' in stages or 'icons' in stages:
+        from modfilesystem import ModFileSystem
+        fs = ModFileSystem(dirs)
+
+    if 'locale' in stages:
+        cache = localeCache or openLocaleCache(dirs['cache'])
+        localisations = loadLocalisations(fs, options['locales'] or ['en'], cache)
+        if cache and not localeCache:
+            cache.close()
+
+    if 'icons' in stages and layerCache is None:
+        from layercache import createLayerCache
+        layerCache = createLayerCache(options)
+    return {'fs': fs, 'localisations': localisations, 'pool': None, 'layerCache': layerCache}
 
-import icon
 
 # main post-processing method
-def process(data, dirs):
-    loc = Localisation(dirs)
-
+# Returns the counters of the icon renderer (see IconRenderer.stats, None without the icons
+# stage), data is processed in place.
+def process(data, dirs, options, context=None):
+    if context is None:
+        context = prepare(dirs, options)
+    stages = options['stages']
+    fs = context['fs']
+
+    loc = None
+    if 'locale' in stages:
+        loc = LocaleTables(context['localisations'], collect=bool(options['locales']))
+
+    renderer = None
+    incremental = None
+    if 'icons' in stages:
+        from renderer import IconRenderer
+        renderer = IconRenderer(dirs, fs, options, pool=context['pool'], layerCache=context['layerCache'])
+        if options['incremental']:
+            from incremental import IncrementalBuild
+            incremental = IncrementalBuild(dirs, options, context['localisations'])
+            incremental.attach(renderer, fs)
+
+    # The groups are collected in any case, the prototypes refer to them by name.
     data['groups'] = {}
 
-    processItemsAndFuilds(data, loc, dirs)    
-    processRecipes(data, loc, dirs)
-    processEntities(data, loc, dirs)
-
-    processGroups(data, loc, dirs)
-
-    icon.reportOverFlow()
-
-    del data['raw']
-    outFile = dirs['output'] / 'output.json'
-    print(f"\nDone. Writing to:  {outFile}")
-    with open(outFile, 'w') as f:
-        json.dump(data, f)
-
-
-def processItemsAndFuilds(data, loc, dirs):
+    # The sections of the output are written as soon as they are complete.
+    writer = createOutputWriter(dirs['output'], options)
+    try:
+        # Each stage only needs some types of data.raw, which are freed once it is done (if lazy).
+        processItemsAndFuilds(data, loc, renderer)    
+        releaseRaw(data)
+        writer.writeSection('items', data['items'])
+        writer.writeSection('fluids', data['fluids'])
+
+        processRecipes(data, loc, renderer)
+        releaseRaw(data)
+        writer.writeSection('recipes', data['recipes'])
+
+        processEntities(data, loc, renderer)
+        writer.writeSection('entities', data['entities'])
+
+        data['indexes'] = buildIndexes(data)
+        releaseRaw(data)
+        writer.writeSection('indexes', data['indexes'])
+
+        if 'groups' in stages:
+            processGroups(data, loc, renderer)
+            releaseRaw(data)
+            writer.writeSection('groups', data['groups'])
+        else:
+            del data['groups']
+
+        if renderer:
+            import icon
+            atlas = renderer.run()
+            if atlas:
+                data['atlas'] = atlas
+            icon.reportOverFlow(renderer.stats)
+        if incremental:
+            incremental.finish(renderer)
+
+        # The lazy data.raw is only released, not closed: It can be reused if the log didn't change.
+        releaseRaw(data)
+        del data['raw']
+        if loc:
+            for fileName in loc.write(dirs['output']):
+                print(f"INFO  Wrote the localised strings to:  {dirs['output'] / fileName}")
+
+        if dirs['sqlite']:
+            print(f"INFO  Writing the SQLite export to:  {dirs['sqlite']}")
+            exportSqlite(data, dirs['sqlite'])
+
+        print(f"\nDone. Writing to:  {writer.outFile}")
+        writer.close(data)
+    except BaseException:
+        writer.abort()
+        raise
+    return renderer.stats if renderer else None
+
+
+def processItemsAndFuilds(data, loc, renderer):
     raw = data['raw']
     whitelists = createItemProperityWhitelists()
 
@@ -41,18 +154,22 @@ def processItemsAndFuilds(data, loc, dirs):
             if not 'type' in item:
                 item['type'] = baseType
             
-            rawItem = raw[item['type']][key]
+            owner = f"{plural}:{key}"
+            rawItem = raw[item['type']][key] if renderer else None
+            previous = checkPrototype(renderer, owner, item, rawItem)
 
             ## Localisation
-            item["localised_name"]        = loc.resolve(item["localised_name"])
-            item["localised_description"] = loc.resolve(item["localised_description"], warn=False)
+            if loc:
+                localise(loc, renderer, owner, previous, item, "localised_name", plural)
+                localise(loc, renderer, owner, previous, item, "localised_description", plural, warn=False)
 
             ## Icon
-            newFilename, origIconSpec = icon.process(rawItem, dirs, outputFileName=f"{baseType}-{item['name']}.png")
-            # Note: the icon data was on rawItem, we attach *both* the new filename ('icon') 
-            # and the original icon data ('orig_icon') to item, the rest of rawItem will be discarded!   @Size
-            item['icon'] = newFilename
-            # item['orig_icon'] = origIconSpec
+            if renderer:
+                newFilename, origIconSpec = scheduleIcon(renderer, owner, previous, rawItem, f"{baseType}-{item['name']}.png")
+                # Note: the icon data was on rawItem, we attach *both* the new filename ('icon') 
+                # and the original icon data ('orig_icon') to item, the rest of rawItem will be discarded!   @Size
+                item['icon'] = newFilename
+                # item['orig_icon'] = origIconSpec
 
             addGroupData(data['groups'], item, 'recipes')
 
@@ -72,7 +189,7 @@ def processItemsAndFuilds(data, loc, dirs):
     doProcessing('fluid')
 
 
-def processRecipes(data, loc, dirs):
+def processRecipes(data, loc, renderer):
     raw = data['raw']
     progress = ProgressBar("recipes", len(data['recipes']))
 
@@ -80,37 +197,41 @@ def processRecipes(data, loc, dirs):
         if counter % 50 == 0:
             progress.update(counter)
 
-        rawRecipe = raw['recipe'][key]
-        
+        owner = f"recipes:{key}"
+        rawRecipe = raw['recipe'][key] if renderer else None
+        previous = checkPrototype(renderer, owner, recipe, rawRecipe)
+
         ## Localisation
-        recipe["localised_name"]        = loc.resolve(recipe["localised_name"])
-        recipe["localised_description"] = loc.resolve(recipe["localised_description"], warn=False)
+        if loc:
+            localise(loc, renderer, owner, previous, recipe, "localised_name", 'recipes')
+            localise(loc, renderer, owner, previous, recipe, "localised_description", 'recipes', warn=False)
 
         ## Icon        
-        # The newFilename is 'recipe-<name>.png'
-        newFilename, origIconSpec = icon.process(rawRecipe, dirs, outputFileName='recipe-' + recipe['name'] + ".png", warn=False)
-        if newFilename:
-            recipe['icon'] = newFilename
-            #recipe['orig_icon'] = origIconSpec
-        else:
-            if recipe['main_product']:
-                # Fallback to the main_product
-                fallback = recipe['main_product']
-            else: 
-                # Just use something...
-                fallback = recipe['products'][0]
-
-            fallbackType = fallback['type'] + 's'
-            fallbackItem = data[fallbackType][fallback['name']]
-            recipe['icon'] = fallbackItem['icon']
-            #recipe['orig_icon'] = fallbackItem['orig_icon']
+        if renderer:
+            # The newFilename is 'recipe-<name>.png'
+            newFilename, origIconSpec = scheduleIcon(renderer, owner, previous, rawRecipe, 'recipe-' + recipe['name'] + ".png", warn=False)
+            if newFilename:
+                recipe['icon'] = newFilename
+                #recipe['orig_icon'] = origIconSpec
+            else:
+                if recipe['main_product']:
+                    # Fallback to the main_product
+                    fallback = recipe['main_product']
+                else: 
+                    # Just use something...
+                    fallback = recipe['products'][0]
+
+                fallbackType = fallback['type'] + 's'
+                fallbackItem = data[fallbackType][fallback['name']]
+                recipe['icon'] = fallbackItem['icon']
+                #recipe['orig_icon'] = fallbackItem['orig_icon']
 
         addGroupData(data['groups'], recipe, 'recipes')
     
     progress.finish()
 
 
-def processEntities(data, loc, dirs):
+def processEntities(data, loc, renderer):
     raw = data['raw']
 
     total = sum([len(x) for x in data['entities'].values()])
@@ -122,21 +243,26 @@ def processEntities(data, loc, dirs):
             if counter % 50 == 0:
                 progress.update(counter)
 
-            rawEntity = raw[entity['type']][key]
+            owner = f"entities:{key}"
+            rawEntity = raw[entity['type']][key] if renderer else None
+            previous = checkPrototype(renderer, owner, entity, rawEntity)
 
             ## Localisation
-            entity["localised_name"]        = loc.resolve(entity["localised_name"])
-            entity["localised_description"] = loc.resolve(entity["localised_description"], warn=False)
+            if loc:
+                localise(loc, renderer, owner, previous, entity, "localised_name", 'entities')
+                localise(loc, renderer, owner, previous, entity, "localised_description", 'entities', warn=False)
 
             ## Icon        
-            newFilename, origIconSpec = icon.process(rawEntity, dirs, outputFileName='recipe-' + entity['name'] + ".png", warn=False)
-        
+            if renderer:
+                newFilename, origIconSpec = scheduleIcon(renderer, owner, previous, rawEntity, 'entity-' + entity['name'] + ".png", warn=False)
+                entity['icon'] = newFilename
+
             counter += 1
             
     progress.finish()
 
 
-def processGroups(data, loc, dirs):
+def processGroups(data, loc, renderer):
     groups = data['groups']
     raw = data['raw']
 
@@ -149,13 +275,18 @@ def processGroups(data, loc, dirs):
             print(f"WARN  Found empty item-group: {key}")
             continue
 
+        owner = f"groups:{key}"
+        previous = checkPrototype(renderer, owner, group, rawGroup)
+
         ## Localisation
-        group["localised_name"] = loc.resolve(group["localised_name"])
+        if loc:
+            localise(loc, renderer, owner, previous, group, "localised_name", 'groups')
 
         ## Icon        
-        newFilename, origIconSpec = icon.process(rawGroup, dirs, outputFileName='group-' + group['name'] + ".png")
-        group['icon'] = newFilename
-        group['orig_icon'] = origIconSpec
+        if renderer:
+            newFilename, origIconSpec = scheduleIcon(renderer, owner, previous, rawGroup, 'group-' + group['name'] + ".png")
+            group['icon'] = newFilename
+            group['orig_icon'] = origIconSpec
 
     
     for (key, rawSubgroup) in raw['item-subgroup'].items():
@@ -174,7 +305,44 @@ def processGroups(data, loc, dirs):
             continue
 
         ## Localisation
-        subgroup["localised_name"] = loc.resolve(subgroup["localised_name"])
+        if loc:
+            loc.localise(subgroup, "localised_name", 'subgroups')
+
+
+# Incremental mode: Returns the entry of the previous run if the prototype did not change (see
+# IncrementalBuild.check), else None. owner identifies the prototype (e.g. 'items:coal'), obj is
+# checked before it is localised.
+def checkPrototype(renderer, owner, obj, rawObj):
+    if not (renderer and renderer.incremental):
+        return None
+    return renderer.incremental.check(owner, obj, rawObj)
+
+
+# Localises obj[field], in incremental mode unchanged prototypes keep the strings of the previous run.
+def localise(loc, renderer, owner, previous, obj, field, section, warn=True):
+    if not (renderer and renderer.incremental):
+        loc.localise(obj, field, section, warn)
+        return
+
+    resolved = renderer.incremental.previousStrings(previous, field)
+    resolved = loc.localise(obj, field, section, warn, resolved=resolved)
+    renderer.incremental.recordStrings(owner, field, resolved)
+
+
+# Schedules the icon of a prototype, previous: see checkPrototype
+def scheduleIcon(renderer, owner, previous, rawObj, outputFileName, warn=True):
+    if not renderer.incremental:
+        return renderer.schedule(rawObj, outputFileName=outputFileName, warn=warn)
+
+    pinned = previous['icon'] if previous else None
+    result = renderer.schedule(rawObj, outputFileName=outputFileName, warn=warn, pinned=pinned, owner=owner)
+    renderer.incremental.record(owner, result[0])
+    return result
+
+
+def releaseRaw(data):
+    if isinstance(data['raw'], LazyDataRaw):
+        data['raw'].release()
 
 
 def addGroupData(groups, obj, itemType):
@@ -0,0 +1,289 @@
+import hashlib
+import json
+import multiprocessing
+import os
+
+from PIL import Image
+
+import icon
+import layercache
+from iconcache import IconCache
+from progressbar import ProgressBar
+
+# Collects all icon jobs of a run and renders them at once, spread over a pool of processes.
+# The PIL compositing is CPU bound, so threads would not help here.
+#
+# schedule() returns the output filename and the original icon spec right away (the filename is
+# known before anything is rendered), so the callers can keep working with it.
+#
+# Lots of prototypes share the very same icon (an item and its recipe, barrels, entities and
+# their items, ...), so every unique icon spec is only rendered once and all prototypes using
+# it point to the same file.
+
+class IconRenderer:
+    # options: 'jobs', 'atlas', 'layerCacheMB', 'cacheTintedLayers' and 'quiet' (see main.parseArgs)
+    # pool: Optional pool of workers from createPool, which is kept alive after run()
+    # layerCache: Optional layercache.LayerCache for rendering in this process, e.g. kept from a
+    # previous run (the pool workers have their own)
+    def __init__(self, dirs, fs, options, pool=None, layerCache=None):
+        self.dirs = dirs
+        self.fs = fs
+        self.options = options
+        self.jobs = options['jobs'] if options['jobs'] else (os.cpu_count() or 1)
+        self.atlas = options['atlas']
+        self.pool = pool
+        self.layerCache = layerCache
+
+        self.queue = []
+        self.filesBySpec = {}
+        # Counters of the whole run (summed up over all workers)
+        self.stats = {'rendered': 0, 'shared': 0, 'pinned': 0, 'cacheHits': 0, 'overflows': 0, 'overflowsBad': 0}
+
+        # Incremental mode (see incremental.py): The icon files of the previous run
+        self.incremental = None
+        self.previousFiles = {}     # spec hash -> file name
+        self.fileUsers = {}         # file name -> set of owners (e.g. 'items:coal')
+
+
+    # In atlas mode the returned 'filename' is the location of the icon in the atlas instead.
+    #
+    # Incremental mode: 'pinned' is the file of the previous run which is still up to date, it is
+    # used without rendering it again. 'owner' identifies the prototype, so the file of another
+    # prototype (from the previous run) is never overwritten with a different icon.
+    def schedule(self, iconSpec, outputFileName, warn=True, pinned=None, owner=None):
+        oldIconSpec = icon.originalIconSpec(iconSpec, warn and not self.options['quiet'])
+        if oldIconSpec is None:
+            return (None, None)
+
+        # Only send what is needed for rendering to the workers, the raw prototypes can be huge.
+        jobSpec = icon.normalizedSpec(iconSpec)
+
+        specHash = hashlib.sha1(json.dumps(jobSpec, sort_keys=True).encode('utf-8')).hexdigest()
+        if pinned and not specHash in self.filesBySpec and (self.dirs['icons'] / pinned).is_file():
+            self.stats['pinned'] += 1
+            self.filesBySpec[specHash] = pinned
+            outputFileName = pinned
+        elif specHash in self.filesBySpec:
+            self.stats['shared'] += 1
+            outputFileName = self.filesBySpec[specHash]
+        else:
+            slot = len(self.queue)
+            if self.atlas:
+                outputFileName = atlasLocation(slot)
+            elif specHash in self.previousFiles:
+                outputFileName = self.previousFiles[specHash]
+            elif self.fileUsers.get(outputFileName, {owner}) != {owner}:
+                outputFileName = self.uniqueFileName(outputFileName)
+            self.filesBySpec[specHash] = outputFileName
+            if 'name' in iconSpec:
+                jobSpec['name'] = iconSpec['name']
+            self.queue.append((jobSpec, outputFileName, slot))
+
+        iconSpec['icon'] = outputFileName
+        return (outputFileName, oldIconSpec)
+
+
+    # A file name that is neither used in this run nor was used in the previous one
+    def uniqueFileName(self, outputFileName):
+        usedFiles = set(self.filesBySpec.values()) | set(self.fileUsers.keys())
+        (stem, suffix) = os.path.splitext(outputFileName)
+        counter = 2
+        while f"{stem}-{counter}{suffix}" in usedFiles:
+            counter += 1
+        return f"{stem}-{counter}{suffix}"
+
+
+    # Renders all scheduled icons. In atlas mode this returns the atlas description for the output.
+    def run(self):
+        if self.stats['shared'] > 0:
+            total = len(self.queue) + self.stats['shared']
+            print(f"\nINFO  {self.stats['shared']} of {total} icon(s) are shared with other prototypes, rendering only {len(self.queue)}")
+        if self.stats['pinned'] > 0:
+            print(f"INFO  {self.stats['pinned']} icon(s) are unchanged since the previous run")
+
+        if not self.queue:
+            return None
+
+        sheets = []
+        if self.atlas:
+            sheetCount = (len(self.queue) + ATLAS_ICONS_PER_SHEET - 1) // ATLAS_ICONS_PER_SHEET
+            for sheetIdx in range(sheetCount):
+                iconsOnSheet = min(ATLAS_ICONS_PER_SHEET, len(self.queue) - sheetIdx * ATLAS_ICONS_PER_SHEET)
+                rows = (iconsOnSheet + ATLAS_ICONS_PER_ROW - 1) // ATLAS_ICONS_PER_ROW
+                sheets.append(Image.new('RGBA', (ATLAS_SHEET_SIZE, rows * icon.outputSize), (0, 0, 0, 0)))
+
+        jobs = min(self.jobs, len(self.queue))
+        progress = ProgressBar(f"icons (jobs={jobs})", len(self.queue))
+
+        pool = None
+        if self.pool:
+            results = self.pool.imap_unordered(renderJob, self.queue, chunksize=8)
+        elif jobs == 1:
+            inProcess = Worker(self.dirs, self.fs, self.options, self.layerCache)
+            results = map(inProcess.renderJob, self.queue)
+        else:
+            pool = multiprocessing.Pool(jobs, initializer=initWorker, initargs=(self.dirs, self.fs, self.options))
+            results = pool.imap_unordered(renderJob, self.queue, chunksize=8)
+
+        layerCacheStats = {}    # pid -> latest stats of that worker
+        try:
+            for counter, result in enumerate(results):
+                if counter % 50 == 0:
+                    progress.update(counter)
+
+                # The workers count their overflows themselves, we sum them up here.
+                self.stats['rendered'] += 1
+                self.stats['overflows'] += result['overflows']
+                self.stats['overflowsBad'] += result['overflowsBad']
+                self.stats['cacheHits'] += result['cacheHit']
+                if result['layerCache']:
+                    layerCacheStats[result['pid']] = result['layerCache']
+
+                if self.atlas:
+                    location = atlasLocation(result['slot'])
+                    image = Image.frombytes('RGBA', (icon.outputSize, icon.outputSize), result['pixels'])
+                    sheets[location['atlas']].paste(image, box=(location['x'], location['y']))
+        finally:
+            if pool:
+                pool.terminate()
+
+        progress.finish()
+        if self.dirs['cache']:
+            print(f"INFO  {self.stats['cacheHits']}/{len(self.queue)} icon(s) were taken from the cache")
+        layercache.reportStats(list(layerCacheStats.values()))
+        self.queue = []
+
+        if not self.atlas:
+            return None
+
+        sheetFileNames = []
+        for sheetIdx, sheet in enumerate(sheets):
+            sheetFileName = f"atlas-{sheetIdx}.png"
+            with open(self.dirs['icons'] / sheetFileName, 'wb') as f:
+                sheet.save(f)
+            sheetFileNames.append(sheetFileName)
+
+        return {'icon_size': icon.outputSize, 'sheets': sheetFileNames}
+
+
+## Atlas mode
+# All icons have the same size, so the sheets are simple grids filled row by row.
+ATLAS_SHEET_SIZE = 2048
+ATLAS_ICONS_PER_ROW = ATLAS_SHEET_SIZE // icon.outputSize
+ATLAS_ICONS_PER_SHEET = ATLAS_ICONS_PER_ROW * ATLAS_ICONS_PER_ROW
+
+def atlasLocation(slot):
+    posOnSheet = slot % ATLAS_ICONS_PER_SHEET
+    return {
+        'atlas': slot // ATLAS_ICONS_PER_SHEET,
+        'x': (posOnSheet % ATLAS_ICONS_PER_ROW) * icon.outputSize,
+        'y': (posOnSheet // ATLAS_ICONS_PER_ROW) * icon.outputSize,
+    }
+
+
+# A pool of workers that can be used for several runs, so the workers keep their layer caches.
+# Returns None if the icons are rendered in this process anyway.
+def createPool(dirs, fs, options):
+    jobs = options['jobs'] if options['jobs'] else (os.cpu_count() or 1)
+    if jobs == 1:
+        return None
+    return multiprocessing.Pool(jobs, initializer=initWorker, initargs=(dirs, fs, options))
+
+
+## Worker side
+# Renders the jobs of one renderer: in this process (see IconRenderer.run) or in a pool process
+# (the global worker of that process, see initWorker). Everything a worker changes (counters,
+# decoded layers) lives in its icon.RenderState, so renderers in the same process share nothing.
+class Worker:
+    # layerCache: Decoded layers of previous runs (see processing.prepare)
+    def __init__(self, dirs, fs, options, layerCache=None):
+        self.dirs = dirs
+        self.fs = fs
+        self.cache = IconCache(dirs['cache'] / 'icons') if dirs['cache'] else None
+        self.atlas = options['atlas']
+        self.state = icon.RenderState(layerCache, verbose=not options['quiet'])
+
+
+    # Renders a single icon. In atlas mode the RGBA pixels are returned in 'pixels', otherwise the
+    # icon is written to the icons folder.
+    # Note: Icons from the cache do not count towards the overflow counters.
+    def renderJob(self, job):
+        pending = self.startJob(job)
+        if not pending['result']['cacheHit']:
+            before = self.overflowCounters()
+            pending['image'] = icon.render(job[0], self.fs, self.state)
+            self.countOverflows(pending['result'], before)
+        return self.finishJob(pending)
+
+
+    # Looks the icon up in the cache, 'image' is only set for cache hits in atlas mode.
+    def startJob(self, job):
+        (iconSpec, outputFileName, slot) = job
+        result = {'slot': slot, 'cacheHit': False, 'pixels': None, 'overflows': 0, 'overflowsBad': 0, 'pid': os.getpid()}
+        pending = {'job': job, 'result': result, 'image': None, 'key': None, 'outputPath': None}
+
+        if self.cache:
+            pending['key'] = self.cache.key(iconSpec, self.fs)
+
+        if self.atlas:
+            if self.cache:
+                pending['image'] = self.cache.load(pending['key'])
+                result['cacheHit'] = pending['image'] is not None
+        else:
+            pending['outputPath'] = self.dirs['icons'] / outputFileName
+            if self.cache:
+                result['cacheHit'] = self.cache.fetch(pending['key'], pending['outputPath'])
+        return pending
+
+
+    def overflowCounters(self):
+        return (self.state.overflowCounter, self.state.overflowCounterBad)
+
+    # The overflows since before (see overflowCounters)
+    def countOverflows(self, result, before):
+        result['overflows'] = self.state.overflowCounter - before[0]
+        result['overflowsBad'] = self.state.overflowCounterBad - before[1]
+
+
+    # Stores the rendered icon (cache and icons folder), returns the result
+    def finishJob(self, pending):
+        (result, image, key, outputPath) = (pending['result'], pending['image'], pending['key'], pending['outputPath'])
+
+        if not result['cacheHit']:
+            if self.atlas:
+                if self.cache:
+                    self.cache.store(key, image)
+            elif self.cache:
+                self.cache.store(key, image, outputPath)
+            else:
+                # outputPath might still be a hardlink into the cache, never write through it.
+                if outputPath.exists():
+                    outputPath.unlink()
+                with open(outputPath, 'wb') as f:
+                    image.save(f)
+
+        if self.atlas:
+            result['pixels'] = atlasPixels(image)
+
+        layerCache = self.state.layerCache
+        result['layerCache'] = layerCache.stats() if layerCache else None
+        return result
+
+
+# The worker of a pool process, the pool belongs to a single renderer (or context, see createPool).
+worker = None
+
+def initWorker(dirs, fs, options):
+    global worker
+    # Keeps the decoded layers for all runs of the pool (see watch.py)
+    worker = Worker(dirs, fs, options, layercache.createLayerCache(options))
+
+def renderJob(job):
+    return worker.renderJob(job)
+
+
+# Icons that overflowed are slightly larger than outputSize, but the atlas slots are not.
+def atlasPixels(image):
+    if image.size != (icon.outputSize, icon.outputSize):
+        image = image.resize((icon.outputSize, icon.outputSize))
+    return image.tobytes()
@@ -0,0 +1,264 @@
+import argparse
+import json
+import sys
+
+from errors import ScraperError
+
+try:
+    import numpy as np
+    import scipy.optimize
+    import scipy.sparse
+    import scipy.sparse.linalg
+except ImportError:
+    np = None
+
+# Production rate solver over the recipes of output.json.
+#
+# All recipes are put into a sparse matrix A (products x recipes): A[p, r] is the net amount of
+# product p that one craft of recipe r produces (products minus ingredients, expected amounts for
+# probabilities and amount ranges). For target rates t (per second) the crafts per second x of all
+# recipes are the solution of the linear program
+#
+#     minimize    machines(x) + penalty * imports(u)
+#     subject to  A x + u >= t,   x >= 0,   u >= 0
+#
+# u are products that are supplied from outside: Products without any recipe (ores, crude oil, ...)
+# are free, products that could be crafted are expensive. Surplus byproducts are allowed, so loops
+# (barrels, kovarex, ...) and alternative recipes work. The number of machines of a recipe is
+# x * energy / crafting_speed, using the fastest machine of its crafting category.
+#
+# Example:
+#     solver = ProductionSolver(json.load(open('output.json')))
+#     result = solver.solve({'electronic-circuit': 10})
+#     results = solver.solveBatch([{'iron-gear-wheel': 1}, {'fluid:lubricant': 5}])
+#
+# For a fixed choice of one recipe per product, solveLinear() solves many targets at once with a
+# single sparse LU factorization instead.
+
+# Cost of one unit per second of a craftable product that is supplied from outside
+IMPORT_PENALTY = 1e4
+
+# Rates below this are treated as zero
+EPSILON = 1e-9
+
+def checkAvailable():
+    if np is None:
+        raise ScraperError("The solver needs numpy and scipy, install them with: pip install numpy scipy")
+
+
+class ProductionSolver:
+    # exclude: names of recipes that must not be used
+    def __init__(self, data, exclude=()):
+        checkAvailable()
+
+        self.products = []          # (type, name) for every row of the matrix
+        self.productIndex = {}      # (type, name) -> row
+        self.recipes = []           # recipe name for every column of the matrix
+        self.machines = []          # machine (entity name or None) of every recipe
+        craftTime = []              # seconds that one machine needs for one craft, for every recipe
+
+        speeds = fastestMachines(data)
+        rows, columns, values = [], [], []
+        for recipe in data['recipes'].values():
+            if recipe['name'] in exclude:
+                continue
+
+            column = len(self.recipes)
+            self.recipes.append(recipe['name'])
+            (machine, speed) = speeds.get(recipe['category'], (None, 1))
+            self.machines.append(machine)
+            craftTime.append(recipe['energy'] / speed)
+
+            for ingredient in recipe['ingredients']:
+                rows.append(self.product(ingredient['type'], ingredient['name']))
+                columns.append(column)
+                values.append(-ingredient['amount'])
+            for product in recipe['products']:
+                rows.append(self.product(product['type'], product['name']))
+                columns.append(column)
+                values.append(expectedAmount(product))
+
+        # Duplicate entries (a product that is ingredient and product) are summed up
+        self.matrix = scipy.sparse.csc_matrix((values, (rows, columns)), shape=(len(self.products), len(self.recipes)))
+        self.craftTime = np.array(craftTime, dtype=float)
+
+        produced = np.asarray((self.matrix > 0).sum(axis=1)).ravel() > 0
+        self.importCost = np.where(produced, IMPORT_PENALTY, 0.0)
+        self.linearProgram = None   # (cost, constraints), built on the first solve()
+
+
+    def product(self, productType, name):
+        key = (productType, name)
+        if not key in self.productIndex:
+            self.productIndex[key] = len(self.products)
+            self.products.append(key)
+        return self.productIndex[key]
+
+
+    # Turns {'iron-plate': 2, 'fluid:water': 100} into a vector of rates per product.
+    # Names without type are items, or fluids if there is no such item.
+    def targetVector(self, targets):
+        vector = np.zeros(len(self.products))
+        for (key, rate) in targets.items():
+            if ':' in key:
+                productKey = tuple(key.split(':', 1))
+            elif ('item', key) in self.productIndex or not ('fluid', key) in self.productIndex:
+                productKey = ('item', key)
+            else:
+                productKey = ('fluid', key)
+
+            if not productKey in self.productIndex:
+                raise ScraperError(f"No recipe uses or produces '{key}'")
+            vector[self.productIndex[productKey]] += rate
+        return vector
+
+
+    # Returns {'recipes': {recipe: {'rate', 'machine', 'machines'}}, 'inputs': {'type:name': rate}}
+    # with the crafts per second of every recipe that is used and the products supplied from outside.
+    def solve(self, targets):
+        return self.solveVector(self.targetVector(targets))
+
+    # Solves several targets one after another: This is only a convenience loop, every target is a
+    # linear program of its own (only the matrix is built once). See solveLinear for many targets at once.
+    def solveBatch(self, targetsList):
+        return [self.solveVector(self.targetVector(targets)) for targets in targetsList]
+
+
+    def solveVector(self, target):
+        (numProducts, numRecipes) = self.matrix.shape
+        if self.linearProgram is None:
+            cost = np.concatenate([self.craftTime, self.importCost])
+            constraints = scipy.sparse.hstack([-self.matrix, -scipy.sparse.identity(numProducts)], format='csc')
+            self.linearProgram = (cost, constraints)
+
+        (cost, constraints) = self.linearProgram
+        solution = scipy.optimize.linprog(cost, A_ub=constraints, b_ub=-target, bounds=(0, None), method='highs')
+        if not solution.success:
+            raise ScraperError(f"Unable to solve the production rates: {solution.message}")
+
+        return self.result(solution.x[:numRecipes], solution.x[numRecipes:])
+
+
+    # Solves many targets at once for a fixed set of recipes (one per product, e.g. without any
+    # alternatives or loops). recipeChoice maps 'type:name' to the recipe used for it, the others
+    # use the first recipe that produces them and is not used for another product yet.
+    # Products without a recipe are inputs. Returns a list of results like solve().
+    def solveLinear(self, targetsList, recipeChoice={}):
+        chosen = self.chooseRecipes(recipeChoice)
+        rows = list(chosen.keys())
+        columns = list(chosen.values())
+
+        # Square system: one chosen recipe per produced product
+        system = self.matrix[rows, :][:, columns].tocsc()
+        targets = np.column_stack([self.targetVector(t) for t in targetsList])
+        try:
+            lu = scipy.sparse.linalg.splu(system)
+        except RuntimeError as e:
+            # e.g. two chosen recipes produce the products in the same ratio
+            raise ScraperError(f"The chosen recipes can't be solved for the targets ({e}), use solve() instead")
+        rates = lu.solve(targets[rows, :])
+        if rates.ndim == 1:
+            rates = rates.reshape(-1, 1)
+
+        results = []
+        for idx in range(targets.shape[1]):
+            recipeRates = np.zeros(len(self.recipes))
+            recipeRates[columns] = rates[:, idx]
+            if (recipeRates < -EPSILON).any():
+                print("WARN  The chosen recipes need negative rates for some targets, use solve() instead")
+            inputs = np.maximum(targets[:, idx] - self.matrix @ recipeRates, 0)
+            results.append(self.result(recipeRates, inputs))
+        return results
+
+
+    # Returns {row: column} with one recipe for every product that any recipe produces
+    def chooseRecipes(self, recipeChoice):
+        chosen = {}
+        for (key, recipe) in recipeChoice.items():
+            productKey = tuple(key.split(':', 1))
+            if not productKey in self.productIndex:
+                raise ScraperError(f"No recipe uses or produces '{key}', use 'type:name'")
+            if not recipe in self.recipes:
+                raise ScraperError(f"Unknown recipe '{recipe}'")
+            chosen[self.productIndex[productKey]] = self.recipes.index(recipe)
+        used = set(chosen.values())
+
+        positive = (self.matrix > 0).tocoo()
+        for (row, column) in sorted(zip(positive.row.tolist(), positive.col.tolist()), key=lambda x: x[1]):
+            if not row in chosen and not column in used:
+                chosen[row] = column
+                used.add(column)
+        return chosen
+
+
+    def result(self, recipeRates, inputRates):
+        recipes = {}
+        for idx in np.flatnonzero(recipeRates > EPSILON):
+            recipes[self.recipes[idx]] = {
+                'rate': float(recipeRates[idx]),
+                'machine': self.machines[idx],
+                'machines': float(recipeRates[idx] * self.craftTime[idx]),
+            }
+
+        inputs = {}
+        for idx in np.flatnonzero(inputRates > EPSILON):
+            (productType, name) = self.products[idx]
+            inputs[f'{productType}:{name}'] = float(inputRates[idx])
+
+        return {'recipes': recipes, 'inputs': inputs}
+
+
+# Expected amount of a product per craft
+def expectedAmount(product):
+    if 'amount' in product and product['amount'] is not None:
+        amount = product['amount']
+    else:
+        amount = (product['amount_min'] + product['amount_max']) / 2
+    probability = product.get('probability')
+    return amount * (1 if probability is None else probability)
+
+
+# Returns {crafting category: (entity name, crafting_speed)} with the fastest machine of each category
+def fastestMachines(data):
+    result = {}
+    for entitiesOfKind in data['entities'].values():
+        for entity in entitiesOfKind.values():
+            speed = entity.get('crafting_speed')
+            if not speed:
+                continue
+            for category in (entity.get('crafting_categories') or {}):
+                if not category in result or speed > result[category][1]:
+                    result[category] = (entity['name'], speed)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compute the recipes and machines needed for some production rates.')
+    parser.add_argument('outputJson', help='output.json of the post-processing')
+    parser.add_argument('targets', nargs='+', metavar='NAME=RATE', help='product and rate per second, e.g. electronic-circuit=10 or fluid:lubricant=5')
+    args = parser.parse_args()
+
+    try:
+        with open(args.outputJson, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        sys.exit(f"ERROR  Unable to read {args.outputJson}: {e}")
+
+    targets = {}
+    for target in args.targets:
+        (name, separator, rate) = target.rpartition('=')
+        try:
+            targets[name] = float(rate)
+        except ValueError:
+            separator = None
+        if not separator:
+            sys.exit(f"ERROR  Targets have to be NAME=RATE, got: {target}")
+
+    try:
+        result = ProductionSolver(data).solve(targets)
+    except ScraperError as e:
+        sys.exit(f"ERROR  {e}")
+    for (recipe, info) in result['recipes'].items():
+        print(f"{recipe:40} {info['rate']:10.3f}/s  {info['machines']:8.2f} x {info['machine']}")
+    for (product, rate) in result['inputs'].items():
+        print(f"input: {product:33} {rate:10.3f}/s")
@@ -0,0 +1,145 @@
+import json
+import os
+import sqlite3
+
+# Writes the processed data (the same data as output.json) into a SQLite database.
+#
+# The prototypes are split into normalized tables, so the common lookups are simple indexed queries:
+#   which recipes produce X:        SELECT recipe FROM products WHERE name = 'X'
+#   which machines craft category Y: SELECT entity FROM crafting_categories WHERE category = 'Y'
+# Every prototype table has a 'json' column with the complete object as well.
+
+SCHEMA = '''
+CREATE TABLE items (name TEXT PRIMARY KEY, type TEXT, "group" TEXT, subgroup TEXT, "order" TEXT,
+                    localised_name TEXT, localised_description TEXT, icon TEXT, stack_size INTEGER,
+                    fuel_category TEXT, fuel_value REAL, json TEXT);
+CREATE TABLE fluids (name TEXT PRIMARY KEY, "group" TEXT, subgroup TEXT, "order" TEXT,
+                     localised_name TEXT, localised_description TEXT, icon TEXT, json TEXT);
+CREATE TABLE recipes (name TEXT PRIMARY KEY, category TEXT, energy REAL, "group" TEXT, subgroup TEXT, "order" TEXT,
+                      localised_name TEXT, localised_description TEXT, icon TEXT, enabled INTEGER, hidden INTEGER,
+                      json TEXT);
+CREATE TABLE ingredients (recipe TEXT, type TEXT, name TEXT, amount REAL);
+CREATE TABLE products (recipe TEXT, type TEXT, name TEXT, amount REAL, amount_min REAL, amount_max REAL,
+                       probability REAL, is_main INTEGER);
+CREATE TABLE entities (name TEXT PRIMARY KEY, type TEXT, kind TEXT, localised_name TEXT, localised_description TEXT,
+                       icon TEXT, crafting_speed REAL, json TEXT);
+CREATE TABLE crafting_categories (entity TEXT, category TEXT);
+CREATE TABLE groups (name TEXT PRIMARY KEY, "order" TEXT, localised_name TEXT, icon TEXT);
+CREATE TABLE subgroups (name TEXT PRIMARY KEY, "group" TEXT, "order" TEXT, localised_name TEXT);
+
+CREATE INDEX items_type ON items (type);
+CREATE INDEX items_group ON items ("group", subgroup);
+CREATE INDEX fluids_group ON fluids ("group", subgroup);
+CREATE INDEX recipes_category ON recipes (category);
+CREATE INDEX recipes_group ON recipes ("group", subgroup);
+CREATE INDEX ingredients_name ON ingredients (name, type);
+CREATE INDEX ingredients_recipe ON ingredients (recipe);
+CREATE INDEX products_name ON products (name, type);
+CREATE INDEX products_recipe ON products (recipe);
+CREATE INDEX entities_type ON entities (type);
+CREATE INDEX crafting_categories_category ON crafting_categories (category);
+CREATE INDEX crafting_categories_entity ON crafting_categories (entity);
+CREATE INDEX subgroups_group ON subgroups ("group");
+'''
+
+def exportSqlite(data, dbFile):
+    # Build the database next to the final file and replace it at the end, so readers never
+    # see a half written database.
+    tmpFile = dbFile.with_name(f"{dbFile.name}.{os.getpid()}.tmp")
+    if tmpFile.exists():
+        tmpFile.unlink()
+
+    db = sqlite3.connect(tmpFile)
+    try:
+        with db:
+            db.executescript(SCHEMA)
+            insertItems(db, data.get('items', {}))
+            insertFluids(db, data.get('fluids', {}))
+            insertRecipes(db, data.get('recipes', {}))
+            insertEntities(db, data.get('entities', {}))
+            insertGroups(db, data.get('groups', {}))
+        db.close()
+        os.replace(tmpFile, dbFile)
+    except BaseException:
+        db.close()
+        tmpFile.unlink()
+        raise
+
+
+def insertItems(db, items):
+    rows = []
+    for item in items.values():
+        fuel = item.get('fuel') or {}
+        rows.append((item['name'], item.get('type'), item.get('group'), item.get('subgroup'), item.get('order'),
+                     text(item.get('localised_name')), text(item.get('localised_description')), text(item.get('icon')),
+                     item.get('stack_size'), fuel.get('fuel_category'), fuel.get('fuel_value'), toJson(item)))
+    db.executemany('INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+
+def insertFluids(db, fluids):
+    rows = []
+    for fluid in fluids.values():
+        rows.append((fluid['name'], fluid.get('group'), fluid.get('subgroup'), fluid.get('order'),
+                     text(fluid.get('localised_name')), text(fluid.get('localised_description')), text(fluid.get('icon')), toJson(fluid)))
+    db.executemany('INSERT INTO fluids VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+
+def insertRecipes(db, recipes):
+    rows = []
+    ingredients = []
+    products = []
+    for recipe in recipes.values():
+        name = recipe['name']
+        rows.append((name, recipe.get('category'), recipe.get('energy'), recipe.get('group'), recipe.get('subgroup'),
+                     recipe.get('order'), text(recipe.get('localised_name')), text(recipe.get('localised_description')),
+                     text(recipe.get('icon')), recipe.get('enabled'), recipe.get('hidden'), toJson(recipe)))
+
+        for ingredient in recipe.get('ingredients', []):
+            ingredients.append((name, ingredient.get('type'), ingredient['name'], ingredient.get('amount')))
+
+        mainProduct = recipe.get('main_product')
+        for product in recipe.get('products', []):
+            isMain = bool(mainProduct) and mainProduct['name'] == product['name'] and mainProduct.get('type') == product.get('type')
+            products.append((name, product.get('type'), product['name'], product.get('amount'), product.get('amount_min'),
+                             product.get('amount_max'), product.get('probability', 1), isMain))
+
+    db.executemany('INSERT INTO recipes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    db.executemany('INSERT INTO ingredients VALUES (?, ?, ?, ?)', ingredients)
+    db.executemany('INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?)', products)
+
+
+# entities: {kind: {name: entity}}, kind is e.g. 'crafting-machine' (see output.json)
+def insertEntities(db, entities):
+    rows = []
+    categories = []
+    for (kind, entitiesOfKind) in entities.items():
+        for entity in entitiesOfKind.values():
+            rows.append((entity['name'], entity.get('type'), kind, text(entity.get('localised_name')),
+                         text(entity.get('localised_description')), text(entity.get('icon')), entity.get('crafting_speed'),
+                         toJson(entity)))
+            for category in (entity.get('crafting_categories') or {}):
+                categories.append((entity['name'], category))
+
+    db.executemany('INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    db.executemany('INSERT INTO crafting_categories VALUES (?, ?)', categories)
+
+
+def insertGroups(db, groups):
+    groupRows = []
+    subgroupRows = []
+    for group in groups.values():
+        groupRows.append((group['name'], group.get('order'), text(group.get('localised_name')), text(group.get('icon'))))
+        for subgroup in group.get('subgroups', {}).values():
+            subgroupRows.append((subgroup['name'], group['name'], subgroup.get('order'), text(subgroup.get('localised_name'))))
+
+    db.executemany('INSERT INTO groups VALUES (?, ?, ?, ?)', groupRows)
+    db.executemany('INSERT OR REPLACE INTO subgroups VALUES (?, ?, ?, ?)', subgroupRows)
+
+
+# Localised strings that were not resolved are still LocalisedStrings (lists), in atlas mode the
+# icons are locations (dicts): Both are stored as JSON.
+def text(value):
+    return value if value is None or isinstance(value, str) else toJson(value)
+
+def toJson(obj):
+    return json.dumps(obj, separators=(',', ':'))
@@ -0,0 +1,124 @@
+import io
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+# The post-processing modules are plain scripts that import each other by name.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import dataraw
+
+
+# Reads the icons and locale files from memory instead of mod folders/zips, see modfilesystem.ModFileSystem.
+# files: '__<mod>__/<path>' -> bytes
+class MemoryFs:
+    def __init__(self, files):
+        self.files = files
+
+    def splitPath(self, path):
+        (mod, relativePath) = path[2:].split('__/', 1)
+        return (mod, relativePath)
+
+    def filePath(self, mod, relativePath):
+        return None
+
+    def modPath(self, mod):
+        return mod
+
+    def read(self, mod, relativePath):
+        return self.files[f"__{mod}__/{relativePath}"]
+
+
+# memoryFs(files) creates a MemoryFs
+@pytest.fixture
+def memoryFs():
+    return MemoryFs
+
+
+# A tiny game: core and base (locale en and de, icons), data.raw in factorio-current.log, the
+# script output and an empty mods folder. Returns {'game', 'mods', 'output'}.
+@pytest.fixture
+def factorioGame(tmp_path):
+    game = tmp_path / 'game'
+    for (mod, files) in GAME_FILES.items():
+        for (path, content) in files.items():
+            (game / 'data' / mod / path).parent.mkdir(parents=True, exist_ok=True)
+            (game / 'data' / mod / path).write_text(content, encoding='utf-8')
+
+    (game / 'data' / 'base' / 'graphics' / 'icons').mkdir(parents=True)
+    for (name, color) in GAME_ICONS.items():
+        buffer = io.BytesIO()
+        Image.new('RGBA', (64, 64), color).save(buffer, 'PNG')
+        (game / 'data' / 'base' / 'graphics' / 'icons' / name).write_bytes(buffer.getvalue())
+
+    (game / 'factorio-current.log').write_text('   0.001 Loading mods\n'
+                                               f"{dataraw.MARKER_START.decode()}\n{json.dumps(GAME_DATA_RAW)}\n{dataraw.MARKER_END.decode()}\n")
+    (game / 'script-output').mkdir()
+    for (fileName, content) in GAME_SCRIPT_OUTPUT.items():
+        (game / 'script-output' / fileName).write_text(json.dumps(content))
+
+    mods = tmp_path / 'mods'
+    mods.mkdir()
+    (mods / 'mod-list.json').write_text('{"mods": [{"name": "base", "enabled": true}]}')
+    output = tmp_path / 'output'
+    output.mkdir()
+    return {'game': game, 'mods': mods, 'output': output}
+
+
+GAME_FILES = {
+    'core': {
+        'info.json': '{"name": "core", "version": "1.0.0"}',
+        'locale/en/core.cfg': '[item-group-name]\nintermediate-products=Intermediate products\n',
+    },
+    'base': {
+        'info.json': '{"name": "base", "version": "1.0.0", "dependencies": ["core"]}',
+        'locale/en/base.cfg': '[item-name]\niron-plate=Iron plate\ncoal=Coal\n[fluid-name]\nwater=Water\n'
+                              '[item-description]\ncoal=Burn it in the __ENTITY__assembling-machine__\n'
+                              '[entity-name]\nassembling-machine=Assembling machine\n'
+                              '[item-subgroup-name]\nraw-material=Raw material\n',
+        'locale/de/base.cfg': '[item-name]\niron-plate=Eisenplatte\n[entity-name]\nassembling-machine=Montagemaschine\n',
+    },
+}
+
+GAME_ICONS = {'iron-plate.png': (200, 0, 0, 255), 'coal.png': (20, 20, 20, 255), 'water.png': (0, 0, 255, 128),
+              'assembling-machine.png': (128, 128, 128, 255), 'group.png': (0, 200, 0, 255)}
+
+GAME_DATA_RAW = {
+    'item': {
+        'iron-plate': {'name': 'iron-plate', 'icon': '__base__/graphics/icons/iron-plate.png', 'icon_size': 64},
+        'coal': {'name': 'coal', 'icon': '__base__/graphics/icons/coal.png', 'icon_size': 64},
+    },
+    'fluid': {'water': {'name': 'water', 'icon': '__base__/graphics/icons/water.png', 'icon_size': 64}},
+    'recipe': {'iron-plate': {'name': 'iron-plate'}},
+    'assembling-machine': {'assembling-machine': {'name': 'assembling-machine', 'icon': '__base__/graphics/icons/assembling-machine.png', 'icon_size': 64}},
+    'item-group': {'intermediate-products': {'name': 'intermediate-products', 'icon': '__base__/graphics/icons/group.png', 'icon_size': 64}},
+    'item-subgroup': {'raw-material': {'name': 'raw-material', 'group': 'intermediate-products'}},
+}
+
+def gamePrototype(name, localisedName, **properties):
+    return {
+        'name': name, 'localised_name': localisedName, 'localised_description': [localisedName[0].replace('-name.', '-description.')],
+        'group': {'name': 'intermediate-products', 'type': 'item-group', 'localised_name': ['item-group-name.intermediate-products'], 'order': 'c'},
+        'subgroup': {'name': 'raw-material', 'type': 'item-subgroup', 'localised_name': ['item-subgroup-name.raw-material'], 'order': 'a'},
+        'order': 'a', **properties,
+    }
+
+def gameItem(name, fuelCategory=None):
+    return gamePrototype(name, [f"item-name.{name}"], type='item', stack_size=100, flags=None, fuel_category=fuelCategory,
+                         fuel_value=4000000.0 if fuelCategory else 0, fuel_acceleration_multiplier=1,
+                         fuel_top_speed_multiplier=1, fuel_emissions_multiplier=1)
+
+GAME_SCRIPT_OUTPUT = {
+    'items.json': {'iron-plate': gameItem('iron-plate'), 'coal': gameItem('coal', 'chemical')},
+    'fluids.json': {'water': gamePrototype('water', ['fluid-name.water'])},
+    'recipes.json': {'iron-plate': gamePrototype('iron-plate', ['item-name.iron-plate'], category='crafting', energy=3.2,
+                                                 ingredients=[{'type': 'item', 'name': 'coal', 'amount': 1}],
+                                                 products=[{'type': 'item', 'name': 'iron-plate', 'amount': 1, 'probability': 1}],
+                                                 main_product=None, enabled=True, hidden=False)},
+    'entities.json': {'crafting-machine': {'assembling-machine': {
+        'name': 'assembling-machine', 'type': 'assembling-machine', 'crafting_speed': 0.5, 'crafting_categories': {'crafting': True},
+        'localised_name': ['entity-name.assembling-machine'], 'localised_description': ['entity-description.assembling-machine']}}},
+}
@@ -0,0 +1,17 @@
+import batch
+
+
+# The error of a failed profile ends up in its postprocessing.log as well, not only in the summary.
+def testFailedProfileLog(factorioGame, tmp_path):
+    batch.workerPipeline = None
+    batch.initWorker(factorioGame['game'], {}, None)
+    try:
+        outputDir = factorioGame['output']
+        profile = {'name': 'broken', 'mods': factorioGame['mods'], 'log': tmp_path / 'missing.log', 'scriptOutput': None}
+        result = batch.runProfile((profile, outputDir, None))
+    finally:
+        batch.workerPipeline = None
+
+    assert 'missing.log' in result['error']
+    log = (outputDir / 'postprocessing.log').read_text()
+    assert f"ERROR  {result['error']}" in log
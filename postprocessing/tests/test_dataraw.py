@@ -0,0 +1,47 @@
+import json
+
+import dataraw
+
+
+def writeLog(tmp_path, dataRaw):
+    logFile = tmp_path / 'factorio-current.log'
+    logFile.write_text('   0.001 Loading mods\n'
+                       f"{dataraw.MARKER_START.decode()}\n{dataRaw}\n{dataraw.MARKER_END.decode()}\n"
+                       '   1.234 Done\n', encoding='utf-8')
+    return logFile
+
+
+# Strings with brackets, quotes and non-ASCII characters must not confuse the scanning.
+def testScanSameAsFull(tmp_path):
+    raw = {
+        'recipe': {'a': {'name': 'a', 'ingredients': [['b', 1]], 'note': 'brackets } ] { [ and "quotes" \\'}},
+        'item': {'b': {'name': 'b', 'localised_name': ['item-name.b', 'Übergröße ✓']}},
+        'empty': {},
+        'list': [1, 2.5, None, True],
+    }
+    logFile = writeLog(tmp_path, json.dumps(raw, indent=1, ensure_ascii=False))
+
+    assert dataraw.loadDataRaw(logFile) == raw
+    scanned = [(key, value) for (key, _, _, value) in dataraw.scanTopLevel(dataraw.mapDataRawText(logFile))]
+    assert [key for (key, _) in scanned] == list(raw)
+    assert dict(scanned) == raw
+
+
+def testScanEmpty(tmp_path):
+    assert list(dataraw.scanTopLevel(dataraw.mapDataRawText(writeLog(tmp_path, ' { } ')))) == []
+
+
+def testLazySameAsFull(tmp_path):
+    raw = {'recipe': {'a': {'name': 'a', 'note': '{"not": "a key"}'}}, 'item': {'b': {'name': 'b'}}}
+    lazy = dataraw.lazyDataRaw(writeLog(tmp_path, json.dumps(raw)))
+    try:
+        assert list(lazy) == ['recipe', 'item']
+        assert lazy['recipe'] == raw['recipe']
+        assert lazy.loaded.keys() == {'recipe'}
+
+        # Released types are decoded again, changes to them are gone
+        lazy['item']['b']['name'] = 'changed'
+        lazy.release()
+        assert lazy['item'] == raw['item']
+    finally:
+        lazy.close()
@@ -0,0 +1,65 @@
+import io
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+np = pytest.importorskip('numpy')
+
+import icon
+import iconnumpy
+
+
+def randomLayers(rng, count):
+    files = {}
+    sizes = {}
+    for idx in range(count):
+        size = rng.choice([32, 64, 128])
+        # Wider than icon_size, like the mipmaps in the game files
+        image = Image.new('RGBA', (size + size // 2, size), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image)
+        for _ in range(4):
+            (x, y) = (rng.randrange(size), rng.randrange(size))
+            draw.ellipse((x, y, x + rng.randrange(4, size), y + rng.randrange(4, size)),
+                         fill=tuple(rng.randrange(256) for _ in range(4)))
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        path = f"__base__/layer-{idx}.png"
+        files[path] = buffer.getvalue()
+        sizes[path] = size
+    return (files, sizes)
+
+
+def randomIconSpec(rng, sizes, idx):
+    layers = []
+    for layerIdx in range(rng.randrange(2, 5)):
+        path = rng.choice(sorted(sizes))
+        layer = {'icon': path, 'icon_size': sizes[path]}
+        if rng.random() < 0.6:
+            layer['tint'] = {'r': rng.random(), 'g': rng.random(), 'b': rng.random(), 'a': rng.choice([rng.random(), 0.5, 1])}
+        if layerIdx > 0 and rng.random() < 0.6:
+            layer['scale'] = rng.choice([0.25, 0.3, 0.5, 1])
+        if layerIdx > 0 and rng.random() < 0.4:
+            layer['shift'] = [rng.randrange(-12, 12), rng.randrange(-12, 12)]
+        layers.append(layer)
+    return {'name': f"icon-{idx}", 'icons': layers, 'icon_size': 64}
+
+
+# Tints, scales, shifts and overflowing layers give the very same pixels as icon.processMultipleIcons,
+# for single icons and for batches of them.
+@pytest.mark.parametrize('seed', [1, 2])
+def testSameAsPil(memoryFs, seed):
+    state = icon.RenderState(verbose=False)
+    rng = random.Random(seed)
+    (files, sizes) = randomLayers(rng, 8)
+    fs = memoryFs(files)
+    iconSpecs = [randomIconSpec(rng, sizes, idx) for idx in range(60)]
+
+    expected = [np.asarray(icon.processMultipleIcons(iconSpec, fs, state)) for iconSpec in iconSpecs]
+    single = [np.asarray(iconnumpy.processMultipleIcons(iconSpec, fs, state)) for iconSpec in iconSpecs]
+    batch = [np.asarray(image) for image in iconnumpy.processBatch(iconSpecs, fs, state)]
+
+    for (pil, numpySingle, numpyBatch) in zip(expected, single, batch):
+        assert numpySingle.shape == pil.shape
+        assert np.array_equal(numpySingle, pil)
+        assert np.array_equal(numpyBatch, pil)
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+from PIL import Image
+
+from localisation import Localisation
+from pipeline import Pipeline
+
+
+@pytest.fixture
+def resolvedResources(monkeypatch):
+    resources = []
+    resolve = Localisation.resolve
+    def recordingResolve(self, resource, warn=True):
+        resources.append(resource)
+        return resolve(self, resource, warn)
+    monkeypatch.setattr(Localisation, 'resolve', recordingResolve)
+    return resources
+
+
+def run(factorioGame, pipeline):
+    pipeline.run(factorioGame['mods'], factorioGame['output'])
+    with open(factorioGame['output'] / 'output.json', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# A rerun only localises the prototypes that changed, unless the locale strings changed.
+def testRerunLocalisesChangedPrototypes(factorioGame, resolvedResources):
+    pipeline = Pipeline(factorioGame['game'], {'incremental': True, 'locales': ['en', 'de']})
+    first = run(factorioGame, pipeline)
+    assert first['items']['coal']['localised_name'] == 'Coal'
+
+    resolvedResources.clear()
+    assert run(factorioGame, pipeline) == first
+    assert not any(resource[0].startswith(('item-name.', 'item-description.', 'fluid-', 'recipe-', 'entity-')) for resource in resolvedResources if resource)
+    with open(factorioGame['output'] / 'locale-de.json', encoding='utf-8') as f:
+        assert json.load(f)['items']['iron-plate']['localised_name'] == 'Eisenplatte'
+
+    # Only the changed prototype is localised again
+    itemsFile = factorioGame['game'] / 'script-output' / 'items.json'
+    items = json.loads(itemsFile.read_text())
+    items['coal']['localised_name'] = ['item-name.iron-plate']
+    itemsFile.write_text(json.dumps(items))
+    resolvedResources.clear()
+    assert run(factorioGame, pipeline)['items']['coal']['localised_name'] == 'Iron plate'
+    assert ['item-name.iron-plate'] in resolvedResources
+    assert not ['fluid-name.water'] in resolvedResources
+
+    # Changed locale strings are resolved again for all prototypes
+    localeFile = factorioGame['game'] / 'data' / 'base' / 'locale' / 'en' / 'base.cfg'
+    localeFile.write_text(localeFile.read_text().replace('water=Water', 'water=Fresh water'))
+    resolvedResources.clear()
+    assert run(factorioGame, pipeline)['fluids']['water']['localised_name'] == 'Fresh water'
+    assert ['fluid-name.water'] in resolvedResources
+
+
+# Unchanged prototypes keep their icon files, changed prototypes are rendered again under the same
+# name and the files of removed prototypes are deleted.
+def testRerunPinsIcons(factorioGame):
+    iconDir = factorioGame['output'] / 'icons'
+    pipeline = Pipeline(factorioGame['game'], {'incremental': True})
+    run(factorioGame, pipeline)
+    assert pipeline.stats['rendered'] == 5
+    files = {f.name: f.stat().st_mtime_ns for f in iconDir.iterdir()}
+    assert 'item-coal.png' in files
+
+    run(factorioGame, pipeline)
+    assert (pipeline.stats['pinned'], pipeline.stats['rendered']) == (5, 0)
+    assert {f.name: f.stat().st_mtime_ns for f in iconDir.iterdir()} == files
+
+    icons = factorioGame['game'] / 'data' / 'base' / 'graphics' / 'icons'
+    (icons / 'water.png').write_bytes((icons / 'coal.png').read_bytes())
+    itemsFile = factorioGame['game'] / 'script-output' / 'items.json'
+    items = json.loads(itemsFile.read_text())
+    del items['coal']
+    itemsFile.write_text(json.dumps(items))
+    # The decoded layers are kept between the runs, see Pipeline.reset
+    pipeline.reset()
+
+    output = run(factorioGame, pipeline)
+    assert output['fluids']['water']['icon'] == 'fluid-water.png'
+    # The water and the group (which lists its items)
+    assert (pipeline.stats['pinned'], pipeline.stats['rendered']) == (2, 2)
+    with Image.open(iconDir / 'fluid-water.png') as image:
+        assert image.getpixel((0, 0)) == (20, 20, 20, 255)
+    assert sorted(f.name for f in iconDir.iterdir()) == sorted(set(files) - {'item-coal.png'})
@@ -0,0 +1,37 @@
+from indexes import buildIndexes
+
+
+def recipe(name, ingredients, products):
+    return {'name': name, 'ingredients': [{'type': t, 'name': n} for (t, n) in ingredients],
+            'products': [{'type': t, 'name': n} for (t, n) in products]}
+
+def entity(name, categories=None):
+    return {'name': name, 'type': 'assembling-machine', 'crafting_categories': categories}
+
+
+def testIndexes():
+    data = {
+        'recipes': {
+            'plate': recipe('plate', [('item', 'ore')], [('item', 'plate')]),
+            # The same product twice is listed once
+            'cracking': recipe('cracking', [('fluid', 'oil'), ('item', 'plate')], [('fluid', 'gas'), ('fluid', 'gas')]),
+        },
+        'items': {'coal': {'name': 'coal', 'fuel': {'fuel_category': 'chemical'}}, 'plate': {'name': 'plate'}},
+        'entities': {'crafting-machine': {
+            'am-1': entity('am-1', {'crafting': True}), 'am-2': entity('am-2', {'crafting': True, 'advanced': True}),
+            'am-3': entity('am-3'), 'loop-a': entity('loop-a'), 'loop-b': entity('loop-b'),
+        }},
+        'raw': {'assembling-machine': {
+            'am-1': {'next_upgrade': 'am-2'}, 'am-2': {'next_upgrade': 'am-3'}, 'am-3': {},
+            'loop-a': {'next_upgrade': 'loop-b'}, 'loop-b': {'next_upgrade': 'loop-a'},
+        }},
+    }
+
+    indexes = buildIndexes(data)
+    assert indexes['produced_by'] == {'item': {'plate': ['plate']}, 'fluid': {'gas': ['cracking']}}
+    assert indexes['consumed_by'] == {'item': {'ore': ['plate'], 'plate': ['cracking']}, 'fluid': {'oil': ['cracking']}}
+    assert indexes['crafting_machines'] == {'crafting': ['am-1', 'am-2'], 'advanced': ['am-2']}
+    assert indexes['fuels'] == {'chemical': ['coal']}
+    assert indexes['next_upgrade'] == {'am-1': 'am-2', 'am-2': 'am-3', 'loop-a': 'loop-b', 'loop-b': 'loop-a'}
+    # Cycles have no start, so they are no chain
+    assert indexes['upgrade_chains'] == [['am-1', 'am-2', 'am-3']]
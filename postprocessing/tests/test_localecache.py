@@ -0,0 +1,53 @@
+import sqlite3
+import time
+
+import localecache
+from localecache import LocaleCache
+
+
+# Two versions of a mod (e.g. of two batch profiles) don't overwrite each other.
+def testVersionsSideBySide(tmp_path):
+    cache = LocaleCache(tmp_path)
+    cache.storeMod('en', 'mod', 'v1', {'item-name': {'a': 'A1'}})
+    cache.storeMod('en', 'mod', 'v2', {'item-name': {'a': 'A2'}})
+    cache.storeMerged('en', 'set1', {'item-name': {'a': 'A1'}})
+    cache.storeMerged('en', 'set2', {'item-name': {'a': 'A2'}})
+    cache.close()
+
+    cache = LocaleCache(tmp_path)
+    assert cache.loadMod('en', 'mod', 'v1') == {'item-name': {'a': 'A1'}}
+    assert cache.loadMod('en', 'mod', 'v2') == {'item-name': {'a': 'A2'}}
+    assert cache.loadMerged('en', 'set1') == {'item-name': {'a': 'A1'}}
+    assert cache.loadMerged('en', 'set2') == {'item-name': {'a': 'A2'}}
+    assert cache.loadMod('en', 'mod', 'v3') is None
+    cache.close()
+
+
+# Rows that were not used for MAX_AGE_DAYS are deleted, used ones are kept.
+def testPruneUnused(tmp_path):
+    cache = LocaleCache(tmp_path)
+    cache.storeMod('en', 'mod', 'old', {})
+    cache.storeMod('en', 'mod', 'used', {})
+    longAgo = time.time() - (localecache.MAX_AGE_DAYS + 1) * 24 * 3600
+    with cache.db:
+        cache.db.execute('UPDATE mods SET used = ?', (longAgo,))
+    assert cache.loadMod('en', 'mod', 'used') == {}
+    cache.close()
+
+    cache = LocaleCache(tmp_path)
+    assert cache.loadMod('en', 'mod', 'old') is None
+    assert cache.loadMod('en', 'mod', 'used') == {}
+    cache.close()
+
+
+# A cache of an older version (with another schema) is replaced.
+def testOldSchema(tmp_path):
+    db = sqlite3.connect(tmp_path / 'locale.sqlite')
+    db.execute('CREATE TABLE mods (locale TEXT, mod TEXT, fingerprint TEXT, data BLOB, PRIMARY KEY (locale, mod))')
+    db.commit()
+    db.close()
+
+    cache = LocaleCache(tmp_path)
+    cache.storeMod('en', 'mod', 'v1', {})
+    assert cache.loadMod('en', 'mod', 'v1') == {}
+    cache.close()
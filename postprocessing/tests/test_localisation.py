@@ -0,0 +1,46 @@
+import localisation
+from localisation import Localisation, LocaleTables
+
+
+ENGLISH = {
+    'item-name': {'coal': 'Coal', 'barrel': '__1__ barrel'},
+    'entity-name': {'boiler': 'Boiler'},
+    'item-description': {'coal': 'Burn it in a __ENTITY__boiler__, not in a __ENTITY__furnace__'},
+}
+
+
+# The references to other prototypes are resolved in the locale that uses the string, unknown
+# ones are replaced with the name of the prototype.
+def testReferences():
+    english = Localisation(None, 'en', data=ENGLISH)
+    german = Localisation(None, 'de', data={'entity-name': {'boiler': 'Heizkessel'}}, fallback=english)
+
+    assert english.resolve(['item-description.coal']) == 'Burn it in a Boiler, not in a furnace'
+    assert german.resolve(['item-description.coal']) == 'Burn it in a Heizkessel, not in a furnace'
+    assert english.resolve(['item-name.barrel', ['item-name.coal']]) == 'Coal barrel'
+    assert english.resolve(['item-name.missing'], warn=False) == ''
+
+
+# Every string is compiled once and every localised string is resolved once.
+def testMemo(monkeypatch):
+    compiled = []
+    compileTemplate = localisation.compileTemplate
+    monkeypatch.setattr(localisation, 'compileTemplate', lambda string: compiled.append(string) or compileTemplate(string))
+    english = Localisation(None, 'en', data=ENGLISH)
+
+    for _ in range(3):
+        assert english.resolve(['item-name.barrel', ['item-name.coal']]) == 'Coal barrel'
+        assert english.resolve(['item-name.barrel', ['entity-name.boiler']]) == 'Boiler barrel'
+    assert sorted(compiled) == ['Boiler', 'Coal', '__1__ barrel']
+    assert len(english.resolved) == 4
+
+
+def testLocaleTables():
+    english = Localisation(None, 'en', data=ENGLISH)
+    german = Localisation(None, 'de', data={'item-name': {'coal': 'Kohle'}}, fallback=english)
+    tables = LocaleTables({'de': german, 'en': english})
+
+    item = {'name': 'coal', 'localised_name': ['item-name.coal']}
+    assert tables.localise(item, 'localised_name', 'items') == {'de': 'Kohle', 'en': 'Coal'}
+    assert item['localised_name'] == 'Kohle'
+    assert tables.tables['en'] == {'items': {'coal': {'localised_name': 'Coal'}}}
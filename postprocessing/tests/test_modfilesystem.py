@@ -0,0 +1,21 @@
+import json
+
+from modfilesystem import readModInfo, sortByLoadOrder
+
+
+def writeMod(path, info):
+    path.mkdir()
+    (path / 'info.json').write_text(json.dumps(info))
+    return path
+
+
+# A missing 'dependencies' means ['base'], so a mod that sorts before base still loads after it.
+def testDefaultDependencies(tmp_path):
+    core = writeMod(tmp_path / 'core', {'name': 'core', 'version': '1.0.0'})
+    base = writeMod(tmp_path / 'base', {'name': 'base', 'version': '1.0.0'})
+    mod = writeMod(tmp_path / 'aaa_1.0.0', {'name': 'aaa', 'version': '1.0.0'})
+
+    candidates = {name: (path, readModInfo(path, name, '')) for (name, path) in [('core', core), ('base', base), ('aaa', mod)]}
+    assert candidates['aaa'][1]['dependencies'] == ['base']
+    assert candidates['core'][1]['dependencies'] == []
+    assert [name for (name, _) in sortByLoadOrder(candidates)] == ['core', 'base', 'aaa']
@@ -0,0 +1,74 @@
+import gzip
+import hashlib
+import json
+
+import pytest
+
+from outputwriter import OutputWriter, SplitOutputWriter
+
+
+def items(*groups):
+    return {f"item-{group}": {'name': f"item-{group}", 'group': group} for group in groups}
+
+
+# A failed run leaves the previous output (manifest and files) untouched.
+def testSplitAbortKeepsPreviousOutput(tmp_path):
+    writer = SplitOutputWriter(tmp_path, shardByGroup=True)
+    writer.close({'items': items('a'), 'recipes': {}})
+    before = {f.name: f.read_bytes() for f in tmp_path.iterdir()}
+
+    writer = SplitOutputWriter(tmp_path, shardByGroup=True)
+    writer.writeSection('items', items('a', 'b'))
+    writer.abort()
+    assert {f.name: f.read_bytes() for f in tmp_path.iterdir()} == before
+
+
+# Files of the previous manifest that are not used anymore are deleted.
+def testSplitDeletesRemovedShards(tmp_path):
+    SplitOutputWriter(tmp_path, compressions=['gz'], shardByGroup=True).close({'items': items('a', 'b')})
+    assert (tmp_path / 'items-b.json.gz').is_file()
+
+    SplitOutputWriter(tmp_path, shardByGroup=True).close({'items': items('a')})
+    manifest = json.loads((tmp_path / 'manifest.json').read_text())
+    assert list(manifest['items']) == ['a']
+    assert sorted(f.name for f in tmp_path.iterdir()) == ['items-a.json', 'manifest.json']
+
+
+# Every file of the manifest has the hash of its content, which only changes with the content.
+def testSplitManifestHashes(tmp_path):
+    data = {'items': items('a', 'b'), 'recipes': items('a'), 'groups': {'a': {'order': 'a'}}, 'raw': {'not': 'written'}}
+    SplitOutputWriter(tmp_path, shardByGroup=True).close(data)
+    manifest = json.loads((tmp_path / 'manifest.json').read_text())
+
+    assert manifest['items'] == {'a': {'file': 'items-a.json', 'hash': manifest['items']['a']['hash']},
+                                 'b': {'file': 'items-b.json', 'hash': manifest['items']['b']['hash']}}
+    assert manifest['groups']['file'] == 'groups.json'
+    assert not 'raw' in manifest
+    for entry in [manifest['items']['a'], manifest['items']['b'], manifest['recipes']['a'], manifest['groups']]:
+        content = (tmp_path / entry['file']).read_bytes()
+        assert entry['hash'] == hashlib.sha256(content).hexdigest()[0:16]
+    assert json.loads((tmp_path / 'items-b.json').read_text()) == items('b')
+
+    data['items']['item-b']['order'] = 'z'
+    SplitOutputWriter(tmp_path, shardByGroup=True).close(data)
+    changed = json.loads((tmp_path / 'manifest.json').read_text())
+    assert changed['items']['a'] == manifest['items']['a']
+    assert changed['items']['b']['hash'] != manifest['items']['b']['hash']
+
+
+# The compressed copies have the same content as the file itself.
+@pytest.mark.parametrize('compression', ['gz', 'br'])
+def testCompressedCopies(tmp_path, compression):
+    if compression == 'br':
+        brotli = pytest.importorskip('brotli')
+    data = {'items': items('a', 'b'), 'recipes': {'x': {'name': 'Übergröße ✓'}}, 'raw': {'not': 'written'}}
+    writer = OutputWriter(tmp_path / 'output.json', [compression])
+    writer.writeSection('items', data['items'])
+    paths = writer.close(data)
+
+    assert sorted(path.name for path in paths) == ['output.json', f"output.json.{compression}"]
+    content = (tmp_path / 'output.json').read_bytes()
+    assert json.loads(content) == {'items': data['items'], 'recipes': data['recipes']}
+    compressed = (tmp_path / f"output.json.{compression}").read_bytes()
+    assert (gzip.decompress(compressed) if compression == 'gz' else brotli.decompress(compressed)) == content
+    assert sorted(f.name for f in tmp_path.iterdir()) == ['output.json', f"output.json.{compression}"]
@@ -0,0 +1,52 @@
+import io
+
+from PIL import Image
+
+from layercache import LayerCache
+from renderer import Worker
+
+
+def png(color):
+    buffer = io.BytesIO()
+    Image.new('RGBA', (32, 32), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+# Two workers in the same process (e.g. of two pipelines) count their overflows and keep their
+# decoded layers separately.
+def testWorkersShareNothing(tmp_path, memoryFs):
+    fs = memoryFs({'__base__/a.png': png((255, 0, 0, 255)), '__base__/b.png': png((0, 0, 255, 255))})
+    dirs = {'icons': tmp_path, 'cache': None}
+    options = {'atlas': False, 'quiet': True}
+    iconSpec = {'name': 'overflowing', 'icon_size': 32,
+                'icons': [{'icon': '__base__/a.png'}, {'icon': '__base__/b.png', 'shift': [2, 0]}]}
+
+    first = Worker(dirs, fs, options, LayerCache(1 << 20))
+    second = Worker(dirs, fs, options, LayerCache(1 << 20))
+    result = first.renderJob((iconSpec, 'first.png', 0))
+    assert result['overflows'] == 1
+    assert result['layerCache']['entries'] == 2
+
+    result = second.renderJob((iconSpec, 'second.png', 1))
+    assert result['overflows'] == 1
+    assert result['layerCache']['misses'] == 2
+    assert (first.state.overflowCounter, second.state.overflowCounter) == (1, 1)
+    assert (tmp_path / 'first.png').is_file() and (tmp_path / 'second.png').is_file()
+
+
+# Single icons decode their image through the layer cache as well, so a layered icon using the
+# same image afterwards is a hit (and single icons show up in the stats).
+def testSingleIconsUseLayerCache(tmp_path, memoryFs):
+    fs = memoryFs({'__base__/a.png': png((255, 0, 0, 128)), '__base__/b.png': png((0, 0, 255, 255))})
+    worker = Worker({'icons': tmp_path, 'cache': None}, fs, {'atlas': False, 'quiet': True}, LayerCache(1 << 20))
+
+    result = worker.renderJob(({'icon': '__base__/a.png', 'icon_size': 32}, 'single.png', 0))
+    assert (result['layerCache']['hits'], result['layerCache']['misses']) == (0, 1)
+
+    layered = {'icon_size': 32, 'icons': [{'icon': '__base__/b.png'}, {'icon': '__base__/a.png', 'tint': [0, 255, 0, 255]}]}
+    result = worker.renderJob((layered, 'layered.png', 1))
+    assert (result['layerCache']['hits'], result['layerCache']['misses']) == (1, 2)
+
+    # Not changed by the premultiplied alpha of the cached layer
+    with Image.open(tmp_path / 'single.png') as image:
+        assert image.getpixel((0, 0)) == (255, 0, 0, 128)
@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip('scipy')
+
+from errors import ScraperError
+from solver import ProductionSolver
+
+
+def recipe(name, ingredients, products):
+    return {
+        'name': name, 'category': 'crafting', 'energy': 1,
+        'ingredients': [{'type': 'item', 'name': n, 'amount': a} for (n, a) in ingredients],
+        'products': [{'type': 'item', 'name': n, 'amount': a} for (n, a) in products],
+    }
+
+
+def solverFor(*recipes):
+    machine = {'name': 'assembler', 'crafting_speed': 1, 'crafting_categories': {'crafting': True}}
+    data = {'recipes': {r['name']: r for r in recipes}, 'entities': {'assembling-machine': {'assembler': machine}}}
+    return ProductionSolver(data)
+
+
+def testSolve():
+    solver = solverFor(recipe('gear', [('plate', 2)], [('gear', 1)]))
+    result = solver.solve({'gear': 3})
+    assert result['recipes']['gear']['rate'] == pytest.approx(3)
+    assert result['inputs'] == {'item:plate': pytest.approx(6)}
+
+
+def testUnknownTarget():
+    solver = solverFor(recipe('gear', [('plate', 2)], [('gear', 1)]))
+    with pytest.raises(ScraperError):
+        solver.solve({'nope': 1})
+    with pytest.raises(ScraperError):
+        solver.solveLinear([{'gear': 1}], recipeChoice={'item:gear': 'nope'})
+
+
+# Both recipes make a and b in the same ratio, so choosing one for each product is singular
+def testSingularChoice():
+    solver = solverFor(recipe('one', [], [('a', 1), ('b', 1)]), recipe('two', [], [('a', 2), ('b', 2)]))
+    with pytest.raises(ScraperError):
+        solver.solveLinear([{'a': 1}], recipeChoice={'item:a': 'one', 'item:b': 'two'})
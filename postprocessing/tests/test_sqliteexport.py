@@ -0,0 +1,38 @@
+import json
+import sqlite3
+
+from sqliteexport import exportSqlite
+
+
+def group(name):
+    return {'name': name, 'order': 'a', 'localised_name': name.title(), 'icon': 'group-' + name + '.png'}
+
+
+# In atlas mode the icons are locations, localised strings might not be resolved (--atlas --sqlite).
+def testAtlasIconsAndLocalisedStrings(tmp_path):
+    atlasIcon = {'atlas': 0, 'x': 64, 'y': 0}
+    data = {
+        'items': {'coal': {'name': 'coal', 'type': 'item', 'group': 'raw', 'subgroup': 'ores', 'order': 'a',
+                           'localised_name': ['item-name.coal'], 'localised_description': None,
+                           'icon': atlasIcon, 'stack_size': 50}},
+        'fluids': {'water': {'name': 'water', 'group': 'raw', 'subgroup': 'fluids', 'order': 'b',
+                             'localised_name': 'Water', 'icon': atlasIcon}},
+        'recipes': {'coal': {'name': 'coal', 'category': 'crafting', 'energy': 1, 'group': 'raw', 'subgroup': 'ores',
+                             'localised_name': ['recipe-name.coal'], 'icon': atlasIcon, 'enabled': True, 'hidden': False,
+                             'ingredients': [], 'products': [{'type': 'item', 'name': 'coal', 'amount': 1}],
+                             'main_product': None}},
+        'entities': {'furnace': {'stone-furnace': {'name': 'stone-furnace', 'type': 'furnace', 'icon': atlasIcon,
+                                                   'localised_name': ['entity-name.stone-furnace']}}},
+        'groups': {'raw': dict(group('raw'), icon=atlasIcon, subgroups={'ores': {'name': 'ores', 'order': 'a'}})},
+    }
+
+    dbFile = tmp_path / 'output.sqlite'
+    exportSqlite(data, dbFile)
+
+    db = sqlite3.connect(dbFile)
+    (icon, name) = db.execute("SELECT icon, localised_name FROM items WHERE name = 'coal'").fetchone()
+    assert json.loads(icon) == atlasIcon
+    assert json.loads(name) == ['item-name.coal']
+    assert db.execute("SELECT localised_name FROM fluids WHERE name = 'water'").fetchone() == ('Water',)
+    assert json.loads(db.execute("SELECT icon FROM groups WHERE name = 'raw'").fetchone()[0]) == atlasIcon
+    db.close()
@@ -0,0 +1,28 @@
+import os
+
+import watch
+
+
+def touch(path, mtime):
+    os.utime(path, ns=(mtime, mtime))
+
+
+# Only the top level of the mods folder and the info.json of unzipped mods are looked at.
+def testModsSnapshot(tmp_path):
+    (tmp_path / 'mod-list.json').write_text('{"mods": []}')
+    (tmp_path / 'zipped_1.0.0.zip').write_bytes(b'zip')
+    modDir = tmp_path / 'unzipped'
+    (modDir / 'graphics').mkdir(parents=True)
+    (modDir / 'info.json').write_text('{"name": "unzipped", "version": "1.0.0"}')
+    (modDir / 'graphics' / 'icon.png').write_bytes(b'png')
+    before = watch.modsSnapshot(tmp_path)
+
+    (modDir / 'graphics' / 'icon.png').write_bytes(b'changed')
+    assert watch.modsSnapshot(tmp_path) == before
+
+    touch(modDir / 'info.json', 10**18)
+    assert watch.modsSnapshot(tmp_path) != before
+    before = watch.modsSnapshot(tmp_path)
+
+    (tmp_path / 'other_1.0.0.zip').write_bytes(b'zip')
+    assert watch.modsSnapshot(tmp_path) != before
@@ -0,0 +1,117 @@
+import time
+import traceback
+
+import dataraw
+import pipeline
+import processing
+
+# Watch mode: Processes the data again whenever Factorio exported it again (or the mods changed),
+# without paying the startup costs every time.
+#
+# The files are polled (no extra dependencies, works the same everywhere):
+#   - factorio-current.log           -> data.raw is indexed again
+#   - script-output/*.json           -> the script output is loaded again
+#   - the mods folder: mod-list.json, the zips and the unzipped mod folders with their info.json
+#                                    -> mods, locale strings and decoded icon layers are loaded again
+#     Only the top level is checked (the mods folder can be huge), so after editing the files of an
+#     unzipped mod in place, touch its info.json to reload it.
+# Everything else stays in memory between runs: the mod index and open zips, the localisations,
+# the lazily indexed data.raw (lazy is the default in watch mode), and the worker processes with
+# their decoded icon layers.
+# The runs are incremental (see incremental.py), so only changed icons are rendered.
+
+def watch(dirs, options, interval=2.0):
+    if not options['atlas'] and 'icons' in options['stages']:
+        options['incremental'] = True
+
+    context = None
+    dataRaw = None
+    snapshots = {}
+    print(f"INFO  Watching for changes every {interval}s, stop with Ctrl+C")
+
+    try:
+        while True:
+            changed = {key for (key, snapshot) in takeSnapshots(dirs).items() if snapshots.get(key) != snapshot}
+            if not changed:
+                time.sleep(interval)
+                continue
+
+            # Take the snapshots before processing, so changes during a run trigger another one.
+            snapshots = takeSnapshots(dirs)
+            if snapshots['log'] is None:
+                print(f"WARN  {pipeline.dataRawLog(dirs)} does not exist (yet), waiting for it")
+                time.sleep(interval)
+                continue
+
+            if 'mods' in changed and context is not None:
+                print("\nINFO  The mods changed, reloading them")
+                closeContext(context)
+                context = None
+            if 'log' in changed and dataRaw is not None:
+                if isinstance(dataRaw, dataraw.LazyDataRaw):
+                    dataRaw.close()
+                dataRaw = None
+
+            start = time.time()
+            try:
+                if context is None:
+                    context = processing.prepare(dirs, options)
+                    if 'icons' in options['stages']:
+                        import renderer
+                        context['pool'] = renderer.createPool(dirs, context['fs'], options)
+                data = pipeline.loadData(dirs, options, dataRaw)
+                # Only the lazy data.raw can be reused, the other modes return the decoded (and modified) prototypes
+                if isinstance(data['raw'], dataraw.LazyDataRaw):
+                    dataRaw = data['raw']
+
+                processing.process(data, dirs, options, context)
+                print(f"INFO  Finished in {time.time() - start:.1f}s, watching for changes...")
+            except Exception:
+                # Keep watching, the next export might fix it
+                traceback.print_exc()
+                print("WARN  Processing failed, watching for changes...")
+    except KeyboardInterrupt:
+        print("\nINFO  Stopped watching")
+    finally:
+        if context is not None:
+            closeContext(context)
+
+
+def closeContext(context):
+    if context['pool']:
+        context['pool'].terminate()
+    if context['fs']:
+        context['fs'].close()
+    # The decoded layers (context['layerCache'] and the ones of the pool) are dropped with the context,
+    # they might be outdated now.
+
+
+# Returns {'log': ..., 'scriptOutput': ..., 'mods': ...}, each changes whenever one of its files changes
+def takeSnapshots(dirs):
+    scriptOutputs = [dirs['scriptOutput']] if dirs['scriptOutput'] else [dirs['game'] / 'script-output', dirs['mods'] / 'script-output']
+    return {
+        'log': fileSnapshot(pipeline.dataRawLog(dirs)),
+        'scriptOutput': [fileSnapshot(f) for d in scriptOutputs if d.is_dir() for f in sorted(d.glob('*.json'))],
+        'mods': modsSnapshot(dirs['mods']),
+    }
+
+
+def fileSnapshot(path):
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return (str(path), stat.st_mtime_ns, stat.st_size)
+
+
+# Adding, removing or replacing a mod changes the mods folder or the mod folder itself, updating an
+# unzipped mod (e.g. its version) changes its info.json.
+def modsSnapshot(modsDir):
+    result = [fileSnapshot(modsDir)]
+    for path in sorted(modsDir.iterdir()):
+        if path.name == 'script-output':
+            continue
+        result.append(fileSnapshot(path))
+        if path.is_dir():
+            result.append(fileSnapshot(path / 'info.json'))
+    return result